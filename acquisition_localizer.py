@@ -5,6 +5,7 @@ from datetime import datetime
 #from hysds_commons.job_utils import resolve_hysds_job
 from hysds.celery import app
 import util
+import esUtil
 import uuid  # only need this import to simulate returned mozart job id
 from hysds.celery import app
 from hysds_commons.job_utils import submit_mozart_job
@@ -90,7 +91,7 @@ def query_es(endpoint, doc_id):
         search_url = '%s%s/_search' % (es_url, es_index)
     else:
         search_url = '%s/%s/_search' % (es_url, es_index)
-    r = requests.post(search_url, data=json.dumps(query))
+    r = esUtil.post(search_url, query)
 
     if r.status_code != 200:
         print("Failed to query %s:\n%s" % (es_url, r.text))
@@ -190,7 +191,7 @@ def check_ES_status(doc_id):
         search_url = '%s%s/_search' % (es_url, es_index)
     else:
         search_url = '%s/%s/_search' % (es_url, es_index)
-    r = requests.post(search_url, data=json.dumps(query))
+    r = esUtil.post(search_url, query)
 
     if r.status_code != 200:
         print("Failed to query %s:\n%s" % (es_url, r.text))
@@ -214,7 +215,7 @@ def check_ES_status(doc_id):
         time.sleep(sleep_seconds)
         #result = ES.search(index=es_index, body=query)
 
-        r = requests.post(search_url, data=json.dumps(query))
+        r = esUtil.post(search_url, query)
 
         if r.status_code != 200:
             print("Failed to query %s:\n%s" % (es_url, r.text))
@@ -230,32 +231,27 @@ def check_ES_status(doc_id):
 
 def check_slc_status(slc_id, index_suffix):
 
-    result = util.get_dataset(slc_id, index_suffix)
-    total = result['hits']['total']
-
-    if total > 0:
-        return True
-
-    return False
+    return util.dataset_exists(slc_id, index_suffix)
 
 def check_slc_status(slc_id):
 
-    result = util.get_dataset(slc_id)
-    total = result['hits']['total']
+    return esUtil.exists({"query": {"ids": {"values": [slc_id]}}}, "grq")
 
-    if total > 0:
-        return True
+def get_slc_status_bulk(slc_ids):
+    '''check_slc_status for all slc_ids with one ids query. Returns a dict of slc id -> exists.'''
+    found = esUtil.get_by_ids(slc_ids, "grq", source=False, cached=False)
+    return dict((slc_id, slc_id in found) for slc_id in slc_ids)
 
-    return False
 def get_acq_data_from_list(acq_list):
     logger.info("get_acq_data_from_list")
     acq_info = {}
     # Find out status of all Master ACQs, create a ACQ object with that and update acq_info dictionary 
+    acq_datas = util.get_partial_grq_data_bulk(acq_list)
+    slc_status = get_slc_status_bulk([acq_datas[acq]['metadata']['identifier'] for acq in acq_list])
     for acq in acq_list: 
         #logger.info(acq) 
-        #acq_data = util.get_acquisition_data(acq)[0]['fields']['partial'][0] 
-        acq_data = util.get_partial_grq_data(acq)['fields']['partial'][0] 
-        status = check_slc_status(acq_data['metadata']['identifier']) 
+        acq_data = acq_datas[acq]
+        status = slc_status[acq_data['metadata']['identifier']]
         if status: 
             # status=1 
             logger.info("%s exists" %acq_data['metadata']['identifier']) 
@@ -276,11 +272,12 @@ def get_acq_data_from_query(query):
     else:
         logger.info("get_acq_data_from_query : Found %s data" %hits["total"])
  
+    slc_status = get_slc_status_bulk([hit["_source"]['metadata']['identifier'] for hit in hits["hits"]])
     for i in range (len(hits["hits"])):
         acq_data = hits["hits"][i]["_source"]
         #logger.info("\n%s" %acq_data)
         acq = hits["hits"][i]["_id"]
-        status = check_slc_status(acq_data['metadata']['identifier'])
+        status = slc_status[acq_data['metadata']['identifier']]
         if status:
             # status=1
             logger.info("%s exists" %acq_data['metadata']['identifier'])
@@ -602,7 +599,7 @@ def check_ES_status(doc_id):
         search_url = '%s%s/_search' % (es_url, es_index)
     else:
         search_url = '%s/%s/_search' % (es_url, es_index)
-    r = requests.post(search_url, data=json.dumps(query))
+    r = esUtil.post(search_url, query)
 
     if r.status_code != 200:
         print("Failed to query %s:\n%s" % (es_url, r.text))
@@ -626,7 +623,7 @@ def check_ES_status(doc_id):
         time.sleep(sleep_seconds)
         #result = ES.search(index=es_index, body=query)
 
-        r = requests.post(search_url, data=json.dumps(query))
+        r = esUtil.post(search_url, query)
 
         if r.status_code != 200:
             print("Failed to query %s:\n%s" % (es_url, r.text))
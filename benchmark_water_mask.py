@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+'''
+Benchmark and accuracy suite for lightweight_water_mask.
+
+Times covers_*, get_land_area, get_water_area, the percentages and
+get_land_water_stats over the reference polygons of
+lightweight_water_mask.TEST_POLYGONS and over synthetic S1 frame sized
+polygons. Writes the timings and values to a JSON file, and exits with
+status 1 if any reference polygon is off its TEST_RESULTS value, any total
+area is off the WGS84 geodesic area of its polygon, or any frame is off the
+--baseline results, by more than the tolerances.
+
+    benchmark_water_mask.py -o bench.json
+    benchmark_water_mask.py -o bench_new.json --baseline bench.json --engine raster
+
+Memos are cleared before every call, so timings are for the full
+computation. The tile store and prepared geometries are kept warm, as in a
+long running worker.
+'''
+import os, sys, json, math, time, random, logging, argparse, platform
+from datetime import datetime
+import pyproj
+import lightweight_water_mask
+import geomMemo
+
+# set logger
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+
+class LogFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, 'id'): record.id = '--'
+        return True
+
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+logger.setLevel(logging.INFO)
+logger.addFilter(LogFilter())
+
+
+AREA_TOLERANCE = 0.10 # relative, the threshold of lightweight_water_mask.comparison
+AREA_FLOOR = 1.0 # km^2 of slack for areas close to 0
+PERCENTAGE_TOLERANCE = 0.02 # absolute
+FRAME_LENGTH = 170.0 # km along track of an S1 IW frame
+FRAME_WIDTH = 250.0 # km across track of an S1 IW frame
+KM_PER_DEGREE = 111.32
+DENSIFY_DEGREES = 0.01 # edge step of the geodesic reference area
+geod = pyproj.Geod(ellps='WGS84') #globals for speed
+
+
+def within_tolerance(value, expected, column):
+    '''Returns True if value is within the tolerance of expected for a TEST_RESULTS column.'''
+    if isinstance(expected, bool):
+        return bool(value) == expected
+    if column.endswith('_percentage'):
+        return abs(value - expected) <= PERCENTAGE_TOLERANCE
+    return abs(value - expected) <= max(AREA_FLOOR, AREA_TOLERANCE * abs(expected))
+
+
+def geodesic_area(geojson):
+    '''Returns the WGS84 geodesic area in km^2 of a geojson polygon, independently of
+    lightweight_water_mask. Edges are densified in lon/lat first, so they follow the straight
+    lon/lat lines the water mask treats them as rather than great circles.'''
+    area = 0.0
+    for i, ring in enumerate(geojson["coordinates"]):
+        lons, lats = [], []
+        for (x0, y0), (x1, y1) in zip(ring[:-1], ring[1:]):
+            steps = max(1, int(math.ceil(max(abs(x1 - x0), abs(y1 - y0)) / DENSIFY_DEGREES)))
+            for step in range(steps):
+                lons.append(x0 + (x1 - x0) * step / float(steps))
+                lats.append(y0 + (y1 - y0) * step / float(steps))
+        ring_area = abs(geod.polygon_area_perimeter(lons, lats)[0]) / 1e6
+        area += ring_area if i == 0 else -ring_area
+    return area
+
+
+def make_frames(count, seed):
+    '''Returns count geojson polygons the size of an S1 frame, at random places and headings.'''
+    rand = random.Random(seed)
+    frames = []
+    for i in range(count):
+        lon, lat = rand.uniform(-179.0, 177.0), rand.uniform(-60.0, 70.0)
+        # ascending or descending, about 10 degrees off the meridian
+        heading = math.radians(rand.choice([-1, 1]) * rand.uniform(8.0, 14.0) + rand.choice([0.0, 180.0]))
+        coords = []
+        for along, across in ((-0.5, -0.5), (-0.5, 0.5), (0.5, 0.5), (0.5, -0.5), (-0.5, -0.5)):
+            north = along * FRAME_LENGTH * math.cos(heading) - across * FRAME_WIDTH * math.sin(heading)
+            east = along * FRAME_LENGTH * math.sin(heading) + across * FRAME_WIDTH * math.cos(heading)
+            coords.append([lon + east / (KM_PER_DEGREE * math.cos(math.radians(lat))), lat + north / KM_PER_DEGREE])
+        frames.append({"type": "Polygon", "coordinates": [coords]})
+    return frames
+
+
+def timed(function, geojson, timings):
+    '''Calls function(geojson) with cold memos and adds its run time to timings.'''
+    geomMemo.memos.clear()
+    start = time.time()
+    value = function(geojson)
+    elapsed = time.time() - start
+    stat = timings.setdefault(function.__name__, {"calls": 0, "total_s": 0.0, "max_ms": 0.0})
+    stat["calls"] += 1
+    stat["total_s"] += elapsed
+    stat["max_ms"] = max(stat["max_ms"], elapsed * 1000.0)
+    return value
+
+
+def run_fixtures(timings, failures):
+    '''Evaluates TEST_FUNCTIONS over TEST_POLYGONS against TEST_RESULTS, and the total area
+    of each against its geodesic area.'''
+    results = {}
+    for name, coords in sorted(lightweight_water_mask.TEST_POLYGONS.items()):
+        geojson = {"type": "Polygon", "coordinates": [coords]}
+        results[name] = {}
+        for function, expected in zip(lightweight_water_mask.TEST_FUNCTIONS, lightweight_water_mask.TEST_RESULTS[name]):
+            value = timed(function, geojson, timings)
+            value = bool(value) if isinstance(expected, bool) else float(value)
+            ok = within_tolerance(value, expected, function.__name__)
+            results[name][function.__name__] = {"value": value, "expected": expected, "ok": ok}
+            if not ok:
+                failures.append("%s %s : %s, expected %s" %(name, function.__name__, value, expected))
+        stats = timed(lightweight_water_mask.get_land_water_stats, geojson, timings)
+        reference = geodesic_area(geojson)
+        results[name]["geodesic_area"] = reference
+        if not within_tolerance(stats["total_area"], reference, "total_area"):
+            failures.append("%s total area : %s, geodesic %s" %(name, stats["total_area"], reference))
+    return results
+
+
+def run_frames(frames, baseline, timings, failures):
+    '''Evaluates every frame, checks its total area against its geodesic area, that its numbers
+    agree with each other and, if there is a baseline, with the baseline results of the same frame.'''
+    results = []
+    for i, frame in enumerate(frames):
+        stats = timed(lightweight_water_mask.get_land_water_stats, frame, timings)
+        row = {"coordinates": frame["coordinates"], "geodesic_area": geodesic_area(frame)}
+        for function in lightweight_water_mask.TEST_FUNCTIONS:
+            value = timed(function, frame, timings)
+            row[function.__name__] = bool(value) if isinstance(value, bool) else float(value)
+        results.append(row)
+
+        checks = [("total area against the geodesic area", within_tolerance(stats["total_area"], row["geodesic_area"], "total_area")),
+                  ("stats land area", within_tolerance(stats["land_area"], row["get_land_area"], "get_land_area")),
+                  ("covers_land", stats["covers_land"] == row["covers_land"]),
+                  ("covers_water", stats["covers_water"] == row["covers_water"]),
+                  ("land without covers_land", row["covers_land"] or row["get_land_area"] <= AREA_FLOOR)]
+        if baseline is not None and i < len(baseline):
+            for name, value in baseline[i].items():
+                if name in row and name not in ("coordinates", "geodesic_area"):
+                    checks.append(("baseline %s" %name, within_tolerance(row[name], value, name)))
+        for check, ok in checks:
+            if not ok:
+                failures.append("frame %s %s : %s" %(i, check, json.dumps(row)))
+    return results
+
+
+def cmdLineParse():
+    '''
+    Command line parser.
+    '''
+    parser = argparse.ArgumentParser(description='Time lightweight_water_mask and check its accuracy')
+    parser.add_argument('-o', '--output', dest='output', type=str, default='water_mask_benchmark.json',
+            help='JSON file the results are written to')
+    parser.add_argument('-n', '--frames', dest='frames', type=int, default=100,
+            help='number of synthetic S1 frames')
+    parser.add_argument('-s', '--seed', dest='seed', type=int, default=0,
+            help='seed of the synthetic frames')
+    parser.add_argument('-b', '--baseline', dest='baseline', type=str, default=None,
+            help='earlier output whose frame results these must match, made with the same --frames and --seed')
+    parser.add_argument('-e', '--engine', dest='engine', type=str, default=None,
+            help='land area engine, polygon or raster')
+
+    return parser.parse_args()
+
+
+def main():
+    inps = cmdLineParse()
+    geomMemo.MEMO_DIR = None # never time persisted entries
+    if inps.engine:
+        lightweight_water_mask.configure({'water_mask_engine': inps.engine})
+
+    baseline = None
+    if inps.baseline:
+        with open(inps.baseline) as f:
+            baseline = json.load(f)["frames"]
+
+    timings = {}
+    failures = []
+    fixtures = run_fixtures(timings, failures)
+    frames = run_frames(make_frames(inps.frames, inps.seed), baseline, timings, failures)
+    for stat in timings.values():
+        stat["mean_ms"] = stat["total_s"] * 1000.0 / stat["calls"]
+
+    report = {"created": datetime.utcnow().isoformat(),
+              "python": platform.python_version(),
+              "engine": lightweight_water_mask.ENGINE,
+              "tolerances": {"area": AREA_TOLERANCE, "area_floor_km2": AREA_FLOOR, "percentage": PERCENTAGE_TOLERANCE},
+              "seed": inps.seed,
+              "timings": timings,
+              "fixtures": fixtures,
+              "frames": frames,
+              "failures": failures}
+    with open(inps.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    for name, stat in sorted(timings.items()):
+        logger.info("%-24s %6d calls %10.2f ms mean %10.2f ms max" %(name, stat["calls"], stat["mean_ms"], stat["max_ms"]))
+    for failure in failures:
+        logger.info("FAILED : %s" %failure)
+    logger.info("%s failures, results in %s" %(len(failures), inps.output))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+'''
+asyncio fan-out of independent Elasticsearch queries on top of esUtil. The
+queries run on a bounded thread pool and each page of hits is handed to a
+callback on the calling thread as soon as it lands, so CPU-bound work on one
+page overlaps with the HTTP of the others and no query is held in memory whole.
+'''
+import os, logging, asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import esUtil
+
+# set logger
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+
+class LogFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, 'id'): record.id = '--'
+        return True
+
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+logger.setLevel(logging.INFO)
+logger.addFilter(LogFilter())
+
+
+CONCURRENCY = 8 # queries in flight at once, kept under esUtil.POOL_SIZE
+
+
+def configure(ctx):
+    '''Sets the concurrency from the es_concurrency context key.'''
+    global CONCURRENCY
+    if ctx.get("es_concurrency"):
+        CONCURRENCY = max(1, int(ctx["es_concurrency"]))
+    logger.info("ES concurrency : %s" %CONCURRENCY)
+
+
+async def _fan_out(queries, es_index, es_url, callback, on_page, concurrency, kwargs):
+    loop = asyncio.get_event_loop()
+    # pages wait here for on_page. The queue is bounded so threads that fetch faster
+    # than on_page consumes block instead of piling pages up in memory
+    pages = asyncio.Queue(maxsize=2 * concurrency)
+    stop = threading.Event()
+
+    def send(item):
+        if not stop.is_set():
+            asyncio.run_coroutine_threadsafe(pages.put(item), loop).result()
+
+    def fetch(key):
+        if stop.is_set():
+            return
+        scroll = esUtil.scroll_pages(queries[key], es_index, es_url, **kwargs)
+        try:
+            for page in scroll:
+                if stop.is_set():
+                    return
+                send((key, page, None))
+        except Exception as err:
+            send((key, None, err))
+            return
+        finally:
+            scroll.close() # releases the scroll context of a query given up on
+        send((key, None, None))
+
+    # the executor bounds the queries in flight. They are all submitted up front
+    # so its threads keep fetching while on_page runs on the loop thread
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        fetches = [loop.run_in_executor(executor, fetch, key) for key in queries]
+        try:
+            remaining = len(fetches)
+            while remaining > 0:
+                key, page, err = await pages.get()
+                if err is not None:
+                    raise err
+                if page is not None:
+                    on_page(key, page)
+                    continue
+                remaining -= 1
+                if callback is not None:
+                    callback(key)
+        finally:
+            # on an error, let the threads blocked on a full queue finish before the executor joins them
+            stop.set()
+            while not all(f.done() for f in fetches):
+                while not pages.empty():
+                    pages.get_nowait()
+                await asyncio.sleep(0.01)
+            await asyncio.gather(*fetches, return_exceptions=True)
+
+
+def fan_out(queries, es_index=None, es_url=None, callback=None, on_page=None, concurrency=None, **kwargs):
+    '''Runs a dict of key -> query concurrently, at most concurrency at a time.
+    on_page(key, page) is called with each page of hits of a query as it arrives,
+    and callback(key) once all the pages of that query have been, both on the
+    calling thread. kwargs are passed to esUtil.scroll_pages. Returns a dict of
+    key -> hits if no on_page is given.'''
+    results = {}
+    if on_page is None:
+        for key in queries:
+            results[key] = []
+        on_page = lambda key, page: results[key].extend(page)
+    concurrency = min(concurrency or CONCURRENCY, max(1, len(queries)))
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(_fan_out(queries, es_index, es_url, callback, on_page, concurrency, kwargs))
+    finally:
+        loop.close()
+    return results
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+'''
+On-disk cache of Elasticsearch query results used by esUtil, so the steps of a
+sciflo run, and its retries, can share the results of identical queries.
+
+Entries are keyed on the sha256 of the ES url, index and normalized query,
+expire after TTL seconds and the least recently used ones are evicted once
+the cache grows past MAX_BYTES. The cache is off unless a directory is set
+with ES_CACHE_DIR or the es_cache_dir context key.
+'''
+import os, json, time, hashlib, logging, tempfile
+
+# set logger
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+
+class LogFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, 'id'): record.id = '--'
+        return True
+
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+logger.setLevel(logging.INFO)
+logger.addFilter(LogFilter())
+
+
+CACHE_DIR = os.environ.get("ES_CACHE_DIR")
+TTL = int(os.environ.get("ES_CACHE_TTL", 6 * 3600)) # seconds
+MAX_BYTES = int(os.environ.get("ES_CACHE_MAX_MB", 1024)) * 1024 * 1024
+EVICT_EVERY = 100 # puts between scans of the cache directory while under MAX_BYTES
+EVICT_TO = 0.9 # fraction of MAX_BYTES a full cache is evicted down to, so the next scans are not at every put
+
+_size = None #globals for speed, bytes in the cache at the last scan plus the bytes put since
+_puts = 0 # puts since the last scan
+
+
+def configure(ctx):
+    '''Sets the cache directory, ttl and size from the es_cache_dir, es_cache_ttl and
+    es_cache_max_mb context keys. Unset keys keep the environment values.'''
+    global CACHE_DIR, TTL, MAX_BYTES
+    if ctx.get("es_cache_dir"):
+        CACHE_DIR = ctx["es_cache_dir"]
+    if ctx.get("es_cache_ttl"):
+        TTL = int(ctx["es_cache_ttl"])
+    if ctx.get("es_cache_max_mb"):
+        MAX_BYTES = int(ctx["es_cache_max_mb"]) * 1024 * 1024
+    if CACHE_DIR:
+        logger.info("ES cache : %s, ttl : %ss, max size : %s bytes" %(CACHE_DIR, TTL, MAX_BYTES))
+
+
+def key(*parts):
+    '''Returns the cache key of a query, e.g. key(es_url, es_index, query), or None if the cache is off.'''
+    if not CACHE_DIR:
+        return None
+    normalized = json.dumps([p.strip('/') if isinstance(p, str) else p for p in parts], sort_keys=True)
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def _path(cache_key):
+    return os.path.join(CACHE_DIR, "%s.json" %cache_key)
+
+
+def get(cache_key):
+    '''Returns the cached result for cache_key, or None if it is missing or expired.'''
+    if cache_key is None:
+        return None
+    path = _path(cache_key)
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if time.time() - entry['created'] > TTL:
+        _remove(path)
+        return None
+    try:
+        os.utime(path, None) # mtime tracks the last use for eviction
+    except OSError: # evicted by another process since it was read
+        pass
+    return entry['result']
+
+
+def put(cache_key, result):
+    '''Stores result under cache_key. The cache directory is scanned, and the least recently
+    used entries evicted, once the estimated size passes MAX_BYTES or every EVICT_EVERY puts,
+    which also accounts for the entries other processes add.'''
+    global _size, _puts
+    if cache_key is None:
+        return
+    data = json.dumps({"created": time.time(), "result": result})
+    tmp = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.rename(tmp, _path(cache_key))
+    except OSError as err: # the cache is best effort, the query already succeeded
+        logger.info("Could not write ES cache entry %s : %s" %(cache_key, err))
+        if tmp is not None:
+            _remove(tmp)
+        return
+    _puts += 1
+    if _size is not None:
+        _size += len(data)
+    if _size is None or _size > MAX_BYTES or _puts >= EVICT_EVERY:
+        evict()
+
+
+def evict():
+    '''Removes expired entries and, if the cache is past MAX_BYTES, the least recently used ones
+    until it is back to EVICT_TO of it.'''
+    global _size, _puts
+    entries = []
+    now = time.time()
+    try:
+        names = os.listdir(CACHE_DIR)
+    except OSError as err:
+        logger.info("Could not scan ES cache %s : %s" %(CACHE_DIR, err))
+        return
+    for name in names:
+        if not name.endswith(".json"): continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for mtime, size, path in entries)
+    limit = EVICT_TO * MAX_BYTES if total > MAX_BYTES else MAX_BYTES
+    for mtime, size, path in sorted(entries):
+        if total <= limit and now - mtime <= TTL:
+            continue
+        _remove(path)
+        total -= size
+    _size, _puts = total, 0
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
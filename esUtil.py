@@ -0,0 +1,503 @@
+#!/usr/bin/env python
+'''
+Shared Elasticsearch client for the GRQ and Mozart queries made by the standard
+product steps. All requests go through one keep-alive connection pool, the GRQ
+url is read from settings.conf once per process and there is a single
+scan/scroll implementation.
+'''
+import os, re, json, logging, threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+try:
+    import queue
+    from urllib.parse import urlsplit
+except ImportError:
+    import Queue as queue
+    from urlparse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from UrlUtils import UrlUtils
+import esCache
+
+# set logger
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+
+class LogFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, 'id'): record.id = '--'
+        return True
+
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+logger.setLevel(logging.INFO)
+logger.addFilter(LogFilter())
+
+
+POOL_SIZE = 16 # keep-alive connections per host
+MAX_RETRIES = 3 # retries on connection errors
+SCROLL_KEEPALIVE = "5m" # contexts are released explicitly, this only bounds abandoned ones
+
+# pagination strategies:
+#   scan         - search_type=scan + scroll (ES 1.x). page size is per shard
+#   scroll       - scroll sorted on _doc (ES 2+)
+#   search_after - sorted search_after, no server side context (ES 5+)
+#   pit          - point in time + search_after (ES 7.10+)
+PAGINATION_STRATEGIES = ("scan", "scroll", "search_after", "pit")
+PAGINATION = "scan"
+PAGE_SIZE = 100
+ID_BATCH = 1000 # ids per request in get_by_ids, kept under index.max_result_window
+MSEARCH_BATCH = 50 # queries per _msearch request
+MSEARCH_SIZE = 1000 # hits per query in a _msearch response before falling back to pagination
+SLICES = 1 # > 1 fans a query out to that many scroll slices on a thread pool (ES 5+)
+SEARCH_AFTER_SORT = [{"_id": {"order": "asc"}}] # every index has _id, not every index maps a .raw subfield
+PIT_SORT = [{"_shard_doc": "asc"}]
+
+RECORD_FILE = os.environ.get("ES_RECORD_FILE") # if set, every request/response is appended to it, see es_replay.py
+
+_session = None # globals for speed
+_rest_url = None
+_lock = threading.Lock()
+_pagination_overrides = {} # query kind -> {"strategy": ..., "page_size": ..., "slices": ...}
+
+
+def get_session():
+    '''Returns the process-wide requests session backed by a keep-alive connection pool.'''
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=MAX_RETRIES)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def get_rest_url(es_url=None):
+    '''Returns es_url without a trailing slash. Defaults to the GRQ url from settings.conf, read once per process.'''
+    global _rest_url
+    if es_url is None:
+        if _rest_url is None:
+            _rest_url = UrlUtils().rest_url
+        es_url = _rest_url
+    return es_url[:-1] if es_url.endswith('/') else es_url
+
+
+def request_key(method, url, body):
+    '''Returns the (method, path, body) key a request is recorded and replayed under.
+    The host is dropped and json bodies, including _msearch lines, are normalized.'''
+    parts = urlsplit(url)
+    path = re.sub('/+', '/', parts.path)
+    if parts.query:
+        path = "%s?%s" %(path, parts.query)
+    if body is None:
+        return method, path, ""
+    if isinstance(body, bytes):
+        body = body.decode()
+    lines = []
+    for line in body.strip().split("\n"):
+        try:
+            lines.append(json.dumps(json.loads(line), sort_keys=True))
+        except ValueError:
+            lines.append(line.strip())
+    return method, path, "\n".join(lines)
+
+
+def record(method, url, data, r):
+    '''Appends a request/response pair to RECORD_FILE as one json line.'''
+    method, path, body = request_key(method, url, data)
+    line = json.dumps({"method": method, "path": path, "body": body, "status": r.status_code, "response": r.text})
+    with _lock:
+        with open(RECORD_FILE, 'a') as f:
+            f.write(line + "\n")
+
+
+def _request(method, url, data):
+    if isinstance(data, dict):
+        data = json.dumps(data)
+    r = get_session().request(method, url, data=data)
+    if RECORD_FILE:
+        record(method, url, data, r)
+    return r
+
+
+def post(url, data=None):
+    '''POST to ES over the pooled session. data can be a dict (sent as json) or a raw string.'''
+    return _request("POST", url, data)
+
+
+def delete(url, data=None):
+    '''DELETE on ES over the pooled session. data can be a dict (sent as json) or a raw string.'''
+    return _request("DELETE", url, data)
+
+
+def check_response(r, url, query):
+    '''Logs the failed query and raises for any non-200 response.'''
+    if r.status_code != 200:
+        logger.error("Failed to query %s:\n%s" % (url, r.text))
+        logger.error("query: %s" % json.dumps(query, indent=2))
+        r.raise_for_status()
+
+
+def search_url(es_index=None, es_url=None):
+    '''Returns the _search url for es_index, or for all indices if es_index is None.'''
+    rest_url = get_rest_url(es_url)
+    if es_index:
+        return "{}/{}/_search".format(rest_url, es_index)
+    return "{}/_search".format(rest_url)
+
+
+def search(query, es_index=None, es_url=None, cached=True):
+    '''Runs a single (non-scrolling) search and returns the decoded response.
+    cached=False bypasses esCache, e.g. for status checks.'''
+    url = search_url(es_index, es_url)
+    cache_key = esCache.key(url, query) if cached else None
+    result = esCache.get(cache_key)
+    if result is not None:
+        return result
+    r = post(url, query)
+    check_response(r, url, query)
+    result = r.json()
+    esCache.put(cache_key, result)
+    return result
+
+
+def count(query, es_index=None, es_url=None):
+    '''Returns the number of documents matching query with _count. Never cached,
+    never opens a scroll context. A missing index counts as 0.'''
+    rest_url = get_rest_url(es_url)
+    url = "{}/{}/_count".format(rest_url, es_index.strip('/')) if es_index else "{}/_count".format(rest_url)
+    body = {"query": query["query"]}
+    r = post(url, body)
+    if r.status_code == 404:
+        return 0
+    check_response(r, url, body)
+    return r.json()['count']
+
+
+def exists(query, es_index=None, es_url=None):
+    '''Returns True if any document matches query.'''
+    return count(query, es_index, es_url) > 0
+
+
+def find_one(query, es_index=None, es_url=None):
+    '''Returns the first hit of query, or None, with a single uncached search of size 1.'''
+    hits = search(dict(query, size=1), es_index, es_url, cached=False)['hits']['hits']
+    return hits[0] if len(hits) > 0 else None
+
+
+def get_by_ids(ids, es_index=None, es_url=None, source=None, cached=True):
+    '''Fetches documents by id with one ids query per ID_BATCH ids and returns
+    a dict of id -> hit. ids that are not found are left out of the dict.
+    source optionally restricts the returned _source fields, False drops it.'''
+    ids = list(dict.fromkeys(ids))
+    hits = {}
+    for i in range(0, len(ids), ID_BATCH):
+        batch = ids[i:i + ID_BATCH]
+        query = {"query": {"ids": {"values": batch}}, "size": len(batch)}
+        if source is not None:
+            query["_source"] = source
+        for hit in search(query, es_index, es_url, cached)['hits']['hits']:
+            hits.setdefault(hit['_id'], hit)
+    return hits
+
+
+def _total(hits):
+    '''hits.total is a number before ES 7 and {"value": ..., "relation": ...} after.'''
+    total = hits['total']
+    return total['value'] if isinstance(total, dict) else total
+
+
+def iter_msearch(queries, es_index=None, es_url=None, size=None, **kwargs):
+    '''Yields the hits of each of queries in order, running them with _msearch
+    MSEARCH_BATCH at a time. queries can be any iterable. It is read, and the next
+    _msearch sent, only once the hits of the previous batch have been consumed,
+    so a caller that stops early sends no more requests. Queries whose hits do
+    not fit in one response of size hits, or that fail, are streamed on their
+    own with iter_hits, which gets the pagination keyword arguments.'''
+    queries = iter(queries)
+    while True:
+        batch = list(islice(queries, MSEARCH_BATCH))
+        if len(batch) == 0:
+            break
+        for hits in _msearch_batch(batch, es_index, es_url, size or MSEARCH_SIZE, kwargs):
+            yield hits
+
+
+def _msearch_batch(batch, es_index, es_url, size, kwargs):
+    rest_url = get_rest_url(es_url)
+    url = "{}/{}/_msearch".format(rest_url, es_index.strip('/')) if es_index else "{}/_msearch".format(rest_url)
+    results = [esCache.get(esCache.key(rest_url, es_index, query)) for query in batch]
+    pending = [i for i, hits in enumerate(results) if hits is None]
+    if len(pending) == 0:
+        return results
+    lines = []
+    for i in pending:
+        lines.append("{}")
+        lines.append(json.dumps(_paged_body(batch[i], size)))
+    r = post(url, "\n".join(lines) + "\n")
+    check_response(r, url, [batch[i] for i in pending])
+    for i, res in zip(pending, r.json()['responses']):
+        if 'error' in res:
+            logger.info("msearch query failed, rerunning it on its own : %s" %res['error'])
+            results[i] = iter_hits(batch[i], es_index, es_url, **kwargs)
+        elif _total(res['hits']) > len(res['hits']['hits']):
+            logger.info("msearch query has %s hits, more than %s, paginating it" %(_total(res['hits']), size))
+            results[i] = iter_hits(batch[i], es_index, es_url, **kwargs)
+        else:
+            results[i] = res['hits']['hits']
+            esCache.put(esCache.key(rest_url, es_index, batch[i]), results[i])
+    return results
+
+
+def configure(ctx):
+    '''Sets the pagination defaults from a job context.
+
+    es_pagination, es_page_size, es_slices and es_sort set the defaults for every
+    query, and es_pagination_<kind> / es_page_size_<kind> / es_slices_<kind> /
+    es_sort_<kind> override them for one kind of query (acquisition, orbit,
+    blacklist) as passed to pagination(). es_sort is a comma separated list of
+    the fields search_after sorts on, the last one must be unique per document.'''
+    global PAGINATION, PAGE_SIZE, SLICES, SEARCH_AFTER_SORT
+    for key in ctx:
+        prefix = next((p for p in ("es_pagination", "es_page_size", "es_slices", "es_sort") if key.startswith(p)), None)
+        if prefix is None:
+            continue
+        value = ctx[key]
+        if value is None or str(value).strip() == "":
+            continue
+        if prefix == "es_pagination":
+            field, value = "strategy", str(value).strip()
+            if value not in PAGINATION_STRATEGIES:
+                raise RuntimeError("Unknown ES pagination strategy %s for %s" %(value, key))
+        elif prefix == "es_page_size":
+            field, value = "page_size", int(value)
+        elif prefix == "es_sort":
+            field, value = "sort", [{f.strip(): {"order": "asc"}} for f in str(value).split(",") if f.strip()]
+        else:
+            field, value = "slices", max(1, int(value))
+        kind = key[len(prefix):].lstrip("_")
+        if kind:
+            _pagination_overrides.setdefault(kind, {})[field] = value
+        elif field == "strategy":
+            PAGINATION = value
+        elif field == "page_size":
+            PAGE_SIZE = value
+        elif field == "sort":
+            SEARCH_AFTER_SORT = value
+        else:
+            SLICES = value
+    logger.info("ES pagination : %s, page size : %s, slices : %s, sort : %s, overrides : %s" %(PAGINATION, PAGE_SIZE, SLICES, SEARCH_AFTER_SORT, _pagination_overrides))
+    esCache.configure(ctx)
+
+
+def pagination(kind):
+    '''Returns the strategy/page_size/slices/sort keyword arguments configured for a kind of query.'''
+    override = _pagination_overrides.get(kind, {})
+    return {"strategy": override.get("strategy", PAGINATION),
+            "page_size": override.get("page_size", PAGE_SIZE),
+            "slices": override.get("slices", SLICES),
+            "sort": override.get("sort")}
+
+
+def _paged_body(query, page_size, sort=None):
+    '''Returns a copy of query with size and, if given, sort set.'''
+    body = dict(query)
+    body["size"] = page_size
+    if sort is not None:
+        body["sort"] = sort
+    return body
+
+
+def _scan_pages(query, es_index, rest_url, page_size, sort):
+    '''scan + scroll, ES 1.x'''
+    url = "{}?search_type=scan&scroll={}&size={}".format(search_url(es_index, rest_url), SCROLL_KEEPALIVE, page_size)
+    r = post(url, query)
+    check_response(r, url, query)
+    scan_result = r.json()
+    scroll_id = scan_result.get('_scroll_id')
+    try:
+        if scan_result['hits']['total'] == 0:
+            return
+
+        if scroll_id is None:
+            logger.info("_scroll_id not found in scan_result. Returning empty array for the query :\n%s" %query)
+            return
+
+        while True:
+            r = post('%s/_search/scroll?scroll=%s' % (rest_url, SCROLL_KEEPALIVE), scroll_id)
+            r.raise_for_status()
+            res = r.json()
+            scroll_id = res.get('_scroll_id', scroll_id)
+            if len(res['hits']['hits']) == 0: break
+            yield res['hits']['hits']
+    finally:
+        if scroll_id is not None:
+            clear_scroll(scroll_id, rest_url, raw=True)
+
+
+def _scroll_pages(query, es_index, rest_url, page_size, sort):
+    '''scroll sorted on _doc, ES 2+'''
+    url = "{}?scroll={}".format(search_url(es_index, rest_url), SCROLL_KEEPALIVE)
+    body = _paged_body(query, page_size, sort or ["_doc"])
+    r = post(url, body)
+    check_response(r, url, body)
+    res = r.json()
+    scroll_id = res.get('_scroll_id')
+    try:
+        while len(res['hits']['hits']) > 0:
+            yield res['hits']['hits']
+            if scroll_id is None: break
+            r = post('%s/_search/scroll' % rest_url, {"scroll": SCROLL_KEEPALIVE, "scroll_id": scroll_id})
+            r.raise_for_status()
+            res = r.json()
+            scroll_id = res.get('_scroll_id', scroll_id)
+    finally:
+        if scroll_id is not None:
+            clear_scroll(scroll_id, rest_url)
+
+
+def _search_after_pages(query, es_index, rest_url, page_size, sort):
+    '''search_after on a sort key, no server side context'''
+    url = search_url(es_index, rest_url)
+    body = _paged_body(query, page_size, sort or query.get("sort") or SEARCH_AFTER_SORT)
+    while True:
+        r = post(url, body)
+        check_response(r, url, body)
+        hits = r.json()['hits']['hits']
+        if len(hits) == 0: break
+        yield hits
+        if len(hits) < page_size: break
+        body["search_after"] = hits[-1]['sort']
+
+
+def _pit_pages(query, es_index, rest_url, page_size, sort):
+    '''point in time + search_after, ES 7.10+. A point in time is opened on an index, so
+    queries over all indices fall back to scroll.'''
+    if not es_index:
+        logger.info("No index to open a point in time on, using scroll")
+        for hits in _scroll_pages(query, es_index, rest_url, page_size, None):
+            yield hits
+        return
+    r = post("{}/{}/_pit?keep_alive={}".format(rest_url, es_index, SCROLL_KEEPALIVE))
+    r.raise_for_status()
+    pit_id = r.json()['id']
+    url = search_url(None, rest_url)
+    body = _paged_body(query, page_size, sort or query.get("sort") or PIT_SORT)
+    try:
+        while True:
+            body["pit"] = {"id": pit_id, "keep_alive": SCROLL_KEEPALIVE}
+            r = post(url, body)
+            check_response(r, url, body)
+            res = r.json()
+            pit_id = res.get('pit_id', pit_id)
+            hits = res['hits']['hits']
+            if len(hits) == 0: break
+            yield hits
+            if len(hits) < page_size: break
+            body["search_after"] = hits[-1]['sort']
+    finally:
+        r = delete("%s/_pit" % rest_url, {"id": pit_id})
+        if r.status_code != 200:
+            logger.info("Failed to release point in time %s : %s" %(pit_id, r.text))
+
+
+_PAGERS = {
+    "scan": _scan_pages,
+    "scroll": _scroll_pages,
+    "search_after": _search_after_pages,
+    "pit": _pit_pages,
+}
+
+
+def _sliced_pages(query, es_index, rest_url, page_size, sort, slices):
+    '''Sliced scroll, ES 5+. Each slice is drained by its own thread and the
+    pages are yielded in the order they arrive, so hits are not sorted.'''
+    pages = queue.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def drain(slice_id):
+        try:
+            body = dict(query, slice={"id": slice_id, "max": slices})
+            for page in _scroll_pages(body, es_index, rest_url, page_size, sort):
+                if stop.is_set(): break
+                pages.put(page)
+            pages.put(done)
+        except Exception as err:
+            pages.put(err)
+
+    executor = ThreadPoolExecutor(max_workers=slices)
+    try:
+        for slice_id in range(slices):
+            executor.submit(drain, slice_id)
+        remaining = slices
+        while remaining > 0:
+            page = pages.get()
+            if page is done:
+                remaining -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield page
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
+
+
+def clear_scroll(scroll_id, es_url=None, raw=False):
+    '''Releases a scroll context instead of leaving it to time out. raw sends the ES 1.x plain text body.'''
+    data = scroll_id if raw else {"scroll_id": [scroll_id]}
+    r = delete('%s/_search/scroll' % get_rest_url(es_url), data)
+    if r.status_code not in (200, 404):
+        logger.info("Failed to clear scroll %s : %s" %(scroll_id, r.text))
+
+
+def scroll_pages(query, es_index=None, es_url=None, strategy=None, page_size=None, sort=None, slices=None):
+    '''Runs a paginated query and yields its hits one page at a time.
+
+    strategy is one of PAGINATION_STRATEGIES and defaults to PAGINATION. sort
+    is the search_after/pit sort key. slices > 1 runs a sliced scroll on that
+    many threads whatever the strategy. Any scroll or point in time context is
+    released once the pages are exhausted or the generator is closed. The
+    hits of fully read queries are cached when esCache is on.'''
+    strategy = strategy or PAGINATION
+    if strategy not in _PAGERS:
+        raise RuntimeError("Unknown ES pagination strategy : %s" %strategy)
+    rest_url = get_rest_url(es_url)
+    cache_key = esCache.key(rest_url, es_index, query)
+    hits = esCache.get(cache_key)
+    if hits is not None:
+        if len(hits) > 0:
+            yield hits
+        return
+    slices = slices or SLICES
+    if slices > 1:
+        logger.info("Running sliced scroll on %s with %s slices" %(es_index, slices))
+        pages = _sliced_pages(query, es_index, rest_url, page_size or PAGE_SIZE, None, slices)
+    else:
+        if strategy not in ("search_after", "pit"):
+            sort = None # scan and scroll read in _doc order
+        pages = _PAGERS[strategy](query, es_index, rest_url, page_size or PAGE_SIZE, sort)
+    hits = []
+    for page in pages:
+        if cache_key is not None:
+            hits.extend(page)
+        yield page
+    esCache.put(cache_key, hits) # only reached once every page was read
+
+
+def iter_hits(query, es_index=None, es_url=None, **kwargs):
+    '''Yields the hits of a paginated query as their pages arrive.'''
+    for page in scroll_pages(query, es_index, es_url, **kwargs):
+        for hit in page:
+            yield hit
+
+
+def query_es(query, es_index=None, es_url=None, **kwargs):
+    '''Runs a paginated query and returns all the hits. See scroll_pages for the keyword arguments.'''
+    hits = []
+    for page in scroll_pages(query, es_index, es_url, **kwargs):
+        hits.extend(page)
+    return hits
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+'''
+Local stand-in for GRQ/Mozart Elasticsearch that replays a recording made with
+ES_RECORD_FILE=<file> (see esUtil.record), so the enumerator, the acquisition
+selector and the localizers can be run and profiled without a live cluster.
+
+Point GRQ_ES_URL / JOBS_ES_URL and the GRQ url in settings.conf at the
+stand-in, e.g. http://localhost:9200, and run
+
+    es_replay.py recording.jsonl --port 9200 --latency 0.05
+
+Requests are matched on method, path and normalized body, ignoring the host.
+A request made several times gets its recorded responses in order, and the
+last one once they run out, so a replay is deterministic.
+'''
+import os, sys, json, time, logging, argparse, threading
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+import esUtil
+
+# set logger
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+
+class LogFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, 'id'): record.id = '--'
+        return True
+
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+logger.setLevel(logging.INFO)
+logger.addFilter(LogFilter())
+
+
+def load_recording(recording_file):
+    '''Returns a dict of request key -> list of recorded (status, response).'''
+    responses = {}
+    with open(recording_file) as f:
+        for line in f:
+            if line.strip() == "": continue
+            rec = json.loads(line)
+            key = (rec['method'], rec['path'], rec['body'])
+            responses.setdefault(key, []).append((rec['status'], rec['response']))
+    logger.info("Loaded %s requests from %s" %(sum(len(v) for v in responses.values()), recording_file))
+    return responses
+
+
+class Replay(object):
+    '''Hands out the recorded responses of each request in order.'''
+
+    def __init__(self, responses, latency=0.0):
+        self.responses = responses
+        self.latency = latency
+        self.served = {}
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def respond(self, method, path, body):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        key = esUtil.request_key(method, path, body)
+        with self.lock:
+            recorded = self.responses.get(key)
+            if recorded is None:
+                self.misses += 1
+                logger.info("No recorded response for %s %s : %s" %key)
+                return 404, json.dumps({"error": "no recorded response for %s %s" %(method, key[1])})
+            i = self.served.get(key, 0)
+            self.served[key] = i + 1
+        return recorded[min(i, len(recorded) - 1)]
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _replay(self, method):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length > 0 else None
+        status, response = self.server.replay.respond(method, self.path, body)
+        response = response.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def do_GET(self):
+        self._replay("GET")
+
+    def do_POST(self):
+        self._replay("POST")
+
+    def do_PUT(self):
+        self._replay("PUT")
+
+    def do_DELETE(self):
+        self._replay("DELETE")
+
+
+class ReplayServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(recording_file, host="localhost", port=9200, latency=0.0):
+    '''Starts the stand-in in a background thread and returns the server. Its
+    replay attribute counts the requests that had no recorded response.'''
+    server = ReplayServer((host, port), ReplayHandler)
+    server.replay = Replay(load_recording(recording_file), latency)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logger.info("Replaying %s on http://%s:%s with %ss latency" %(recording_file, host, server.server_port, latency))
+    return server
+
+
+def cmdLineParse():
+    '''
+    Command line parser.
+    '''
+    parser = argparse.ArgumentParser(description='Replay recorded Elasticsearch responses on a local port')
+    parser.add_argument('recording', type=str,
+            help='json lines file written with ES_RECORD_FILE')
+    parser.add_argument('--host', dest='host', type=str, default='localhost',
+            help='interface to listen on')
+    parser.add_argument('-p', '--port', dest='port', type=int, default=9200,
+            help='port to listen on')
+    parser.add_argument('-l', '--latency', dest='latency', type=float, default=0.0,
+            help='seconds of latency added to every response')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    inps = cmdLineParse()
+    server = serve(inps.recording, inps.host, inps.port, inps.latency)
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        logger.info("%s requests had no recorded response" %server.replay.misses)
+        server.shutdown()
@@ -4,6 +4,7 @@ import os, sys, re, json, requests, datetime, tarfile, argparse
 from pprint import pprint, pformat
 import numpy as np
 from hysds.celery import app
+import esUtil
 
 #from UrlUtils import UrlUtils
 
@@ -97,29 +98,10 @@ def get_orbits(es_url, otype, timebef, timeaft, mission):
     }
 
     es_index = "grq_*_%s" % otype.lower()
-    if es_url.endswith('/'): es_url = es_url[:-1]
-    search_url = '%s/%s/_search' % (es_url, es_index)
-    r = requests.post("%s?search_type=scan&scroll=60&size=100" % search_url, data=json.dumps(query))
-    if r.status_code == 200:
-        scan_result = r.json()
-        total = scan_result['hits']['total']
-        if total == 0:
-            print("Failed to find %s orbit at %s for: %s" % (otype, search_url, json.dumps(query, indent=2)))
-            return []
-        scroll_id = scan_result['_scroll_id']
-        results = []
-        while True:
-            r = requests.post('%s/_search/scroll?scroll=60m' % es_url, data=scroll_id)
-            res = r.json()
-            scroll_id = res['_scroll_id']
-            if len(res['hits']['hits']) == 0: break
-            results.extend(res['hits']['hits'])
-        return results
-    else:
-        print("Failed to query %s:\n%s" % (es_url, r.text))
-        print("query: %s" % json.dumps(query, indent=2))
-        print("returned: %s" % r.text)
-        r.raise_for_status()
+    results = esUtil.query_es(query, es_index, es_url)
+    if len(results) == 0:
+        print("Failed to find %s orbit at %s for: %s" % (otype, esUtil.search_url(es_index, es_url), json.dumps(query, indent=2)))
+    return results
 
 
 def fetch(starttime, endtime, mission='S1A', outdir='.', dry_run=False):
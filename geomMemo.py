@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+'''
+LRU memos of results computed from geometries, such as the land area of a
+footprint or its intersection with an AOI. Keys are hashes of the rounded
+coordinates, so a footprint seen again in this run, or in an earlier one,
+costs a dictionary lookup.
+
+Each memo keeps its MEMO_SIZE most recently used entries. The memos only live
+in memory unless a directory is set with GEOMETRY_MEMO_DIR or the
+geometry_memo_dir context key. With a directory, every new entry is appended
+to <dir>/<memo>.jsonl and later runs read it back.
+'''
+import os, json, hashlib, logging, tempfile
+from collections import OrderedDict
+
+# set logger
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+
+class LogFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, 'id'): record.id = '--'
+        return True
+
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+logger.setLevel(logging.INFO)
+logger.addFilter(LogFilter())
+
+
+MEMO_DIR = os.environ.get("GEOMETRY_MEMO_DIR")
+MEMO_SIZE = int(os.environ.get("GEOMETRY_MEMO_SIZE", 4096)) # entries per memo
+PRECISION = 7 # decimal places coordinates are rounded to in keys, about 1 cm
+memos = {} #globals for speed, name -> OrderedDict of key -> value, least recently used first
+
+
+def configure(ctx):
+    '''Sets the memo directory and size from the geometry_memo_dir and geometry_memo_size context keys.
+    Unset keys keep the environment values.'''
+    global MEMO_DIR, MEMO_SIZE
+    if ctx.get("geometry_memo_dir"):
+        MEMO_DIR = ctx["geometry_memo_dir"]
+    if ctx.get("geometry_memo_size"):
+        MEMO_SIZE = max(1, int(ctx["geometry_memo_size"]))
+    if MEMO_DIR:
+        logger.info("Geometry memo : %s, size : %s" %(MEMO_DIR, MEMO_SIZE))
+
+
+def _canonical(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return round(float(value), PRECISION)
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, dict):
+        return dict((k, _canonical(v)) for k, v in value.items())
+    if hasattr(value, '__geo_interface__'): # shapely geometries
+        return _canonical(value.__geo_interface__)
+    return value
+
+
+def geometry_key(*parts):
+    '''Returns the key of a combination of geojson dicts, shapely geometries and plain values,
+    e.g. geometry_key(aoi_location, footprint), with every number rounded to PRECISION places.'''
+    canonical = json.dumps([_canonical(p) for p in parts], sort_keys=True)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _path(name):
+    return os.path.join(MEMO_DIR, "%s.jsonl" %name)
+
+
+def get_memo(name):
+    '''Returns the memo called name, with the entries persisted by earlier runs on first use.'''
+    if name not in memos:
+        memo = memos[name] = OrderedDict()
+        if MEMO_DIR and os.path.exists(_path(name)):
+            lines = 0
+            with open(_path(name)) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError: # cut short by a killed run
+                        continue
+                    lines += 1
+                    memo.pop(entry['key'], None)
+                    memo[entry['key']] = entry['value']
+                    if len(memo) > MEMO_SIZE:
+                        memo.popitem(last=False)
+            logger.info("Loaded %s %s entries from %s" %(len(memo), name, _path(name)))
+            if lines > 2 * len(memo):
+                _compact(name)
+    return memos[name]
+
+
+def get(name, key):
+    '''Returns the value memoized under key in the memo called name, or None.'''
+    memo = get_memo(name)
+    if key not in memo:
+        return None
+    value = memo.pop(key) # move to the most recently used end
+    memo[key] = value
+    return value
+
+
+def put(name, key, value):
+    '''Memoizes value under key in the memo called name. Values must be json serializable to be persisted.'''
+    memo = get_memo(name)
+    memo.pop(key, None)
+    memo[key] = value
+    if len(memo) > MEMO_SIZE:
+        memo.popitem(last=False)
+    if MEMO_DIR:
+        _append(name, key, value)
+
+
+def memoize(name, key, compute):
+    '''Returns the value memoized under key in the memo called name. Calls compute() and
+    memoizes its result the first time.'''
+    value = get(name, key)
+    if value is None:
+        value = compute()
+        put(name, key, value)
+    return value
+
+
+def _append(name, key, value):
+    try:
+        if not os.path.isdir(MEMO_DIR):
+            os.makedirs(MEMO_DIR)
+        line = json.dumps({"key": key, "value": value}) + "\n"
+        with open(_path(name), 'a') as f:
+            f.write(line)
+    except (IOError, OSError, TypeError, ValueError) as err:
+        logger.info("Could not persist %s entry : %s" %(name, err))
+
+
+def _compact(name):
+    '''Rewrites the memo file with only the entries still in the memo.'''
+    try:
+        fd, tmp = tempfile.mkstemp(dir=MEMO_DIR, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            for key, value in memos[name].items():
+                f.write(json.dumps({"key": key, "value": value}) + "\n")
+        os.rename(tmp, _path(name))
+    except (IOError, OSError) as err:
+        logger.info("Could not compact %s : %s" %(_path(name), err))
@@ -9,8 +9,6 @@ import glob
 from isceobj.Orbit.Orbit import Orbit, StateVector
 from isceobj.Util.Poly2D import Poly2D
 import numpy as np
-from isceobj.Planet.Planet import Planet
-from isceobj.Sensor.TOPS.Sentinel1 import Sentinel1 as S1
 from isceobj.Sensor.TOPS.Sentinel1 import s1_findOrbitFile
 from isceobj.Sensor.TOPS.BurstSLC import BurstSLC
 import shapely
@@ -22,160 +20,100 @@ import shapely.ops as ops
 from shapely.geometry.polygon import Polygon
 from functools import partial
 import traceback
+import orbitStore
 
-def extractPreciseOrbit(sentinel1, margin=60.0):
+NEAR_RANGE = 800e3 # S1 IW near slant range in m
+FAR_RANGE = 950e3 # S1 IW far slant range in m
+WAVELENGTH = 0.056 # S1 C-band wavelength in m
+zero_doppler = None #globals for speed, the Poly2D every zero doppler topo call shares
+
+def get_orbit_file(tstart, tend, mission, orbitFile=None, orbitDir=None):
+    '''Returns the path of the orbit file, or of the orbit file in orbitDir covering tstart to tend'''
+    if orbitFile is None and orbitDir is None:
+        raise Exception("Either provide the information of the orbitFile or orbitDir")
+    if orbitFile is not None:
+        return os.path.join(orbitDir, orbitFile) if orbitDir else orbitFile
+    # search the directory for the correct orbit file
+    return s1_findOrbitFile(orbitDir,tstart,tend, mission)
+
+
+def extractPreciseOrbit(orbitFile, tstart, tend, margin=60.0):
     '''
-        Extract precise orbit from given Orbit file.
+        Check that the state vectors of the orbit file from tstart - margin to tend + margin are all NOMINAL.
     '''
     try:
-        try:
-            fp = open(sentinel1.orbitFile,'r')
-        except IOError as strerr:
-            print("IOError: %s" % strerr)
-            traceback.print_exc()
-            return False
- 
-        _xml_root = ET.ElementTree(file=fp).getroot()
- 
-        node = _xml_root.find('Data_Block/List_of_OSVs')
- 
-        print('Extracting orbit from Orbit File: ', sentinel1.orbitFile)
-        orb = Orbit()
-        orb.configure()
- 
-        margin = datetime.timedelta(seconds=margin)
-        print("sentinel1.product.bursts : %s" %sentinel1.product.bursts)
-        tstart = sentinel1.product.bursts[0].sensingStart - margin
-        tend = sentinel1.product.bursts[-1].sensingStop + margin
- 
-        for child in node.getchildren():
-            timestamp = sentinel1.convertToDateTime(child.find('UTC').text[4:])
- 
-            if (timestamp >= tstart) and (timestamp < tend):
- 
-                ###Warn if state vector quality is not nominal
-                quality = child.find('Quality').text.strip()
-                if quality != 'NOMINAL':
-                    print('WARNING: State Vector at time {0} tagged as {1} in orbit file {2}'.format(timestamp, quality, sentinel1.orbitFile))
-                    print("Excluding the date data")
-                    return False
+        print('Checking orbit from Orbit File: ', orbitFile)
+        return orbitStore.is_nominal(orbitFile, tstart, tend, margin)
     except Exception as err:
         print("extractPreciseOrbit Error : %s" %str(err))
         traceback.print_exc()
         return False
 
-    return True
-
-
 
 def isValidOrbit(tstart,tend, mission, orbitFile=None,orbitDir=None):
 
-    orbitFile = os.path.basename(orbitFile)
-    print("groundTrack : isValidOrbit: %s, %s, %s, %s, %s " %(tstart, tend, mission, orbitFile, orbitDir))
-
-    # initiate a Sentinel-1 product instance
-    sentinel1 = S1()
-    sentinel1.configure()
-    
-    # add information on orbit file or orbit directory
-    if orbitFile is None and orbitDir is None:
-        raise Exception("Either provide the information of the orbitFile or orbitDir")
     if orbitFile is not None:
-        # orbit file is specified, will directly feed this into the Sentinel-1 product
-        sentinel1.orbitFile = os.path.join(orbitDir, orbitFile)
-    else:
-        # orbit dir is specified, will directly feed this into the Sentinel-1 product
-        sentinel1.orbitDir=orbitDir
-
-        # search the directory for the correct orbit file
-        sentinel1.orbitFile = s1_findOrbitFile(orbitDir,tstart,tend, mission)
-
-    # ISCE internals read the required time-period to be extracted from the orbit using the sentinel-1 product start and end-times.
-    # Below we will add a dummy burst with the user-defined start and end-time and include it in the sentinel-1 product object.
-   
-    print("Orbit File : %s" %orbitFile) 
-    # Create empty burst SLC
-    burst = []
-    burst1 = BurstSLC()
-    burst1.configure()
-    burst1.burstNumber = 1
-    burst.append(burst1)
-    
-    # adding the start and end time
-    burst[0].sensingStart=tstart
-    burst[0].sensingStop=tend
-    
-    # add SLC burst to product
-    sentinel1.product.bursts = burst
+        orbitFile = os.path.basename(orbitFile)
+    print("groundTrack : isValidOrbit: %s, %s, %s, %s, %s " %(tstart, tend, mission, orbitFile, orbitDir))
 
-    # extract the precise orbit information into an orb variable
-    #orb = sentinel1.extractPreciseOrbit()
-    return extractPreciseOrbit(sentinel1)
+    # the state vectors are parsed once per orbit file by orbitStore, so checking many
+    # acquisitions against the same orbit file costs one parse
+    return extractPreciseOrbit(get_orbit_file(tstart, tend, mission, orbitFile, orbitDir), tstart, tend)
 
 def S1orbit(tstart,tend, mission, orbitFile=None,orbitDir=None):
     '''Function that will extract the sentinel-1 state vector information from the 
-       orbit files and populate a ISCE sentinel-1 product with the state vector information.'''
+       orbit files and populate a ISCE burst SLC with the state vector information.'''
 
-    # initiate a Sentinel-1 product instance
-    sentinel1 = S1()
-    sentinel1.configure()
-    
-    # add information on orbit file or orbit directory
-    if orbitFile is None and orbitDir is None:
-        raise Exception("Either provide the information of the orbitFile or orbitDir")
-    if orbitFile is not None:
-        # orbit file is specified, will directly feed this into the Sentinel-1 product
-        sentinel1.orbitFile = os.path.join(orbitDir, orbitFile)
-    else:
-        # orbit dir is specified, will directly feed this into the Sentinel-1 product
-        sentinel1.orbitDir=orbitDir
-
-        # search the directory for the correct orbit file
-        sentinel1.orbitFile = s1_findOrbitFile(orbitDir,tstart,tend, mission)
-
-    # ISCE internals read the required time-period to be extracted from the orbit using the sentinel-1 product start and end-times.
-    # Below we will add a dummy burst with the user-defined start and end-time and include it in the sentinel-1 product object.
-   
+    orbitFile = get_orbit_file(tstart, tend, mission, orbitFile, orbitDir)
     print("Orbit File : %s" %orbitFile) 
-    # Create empty burst SLC
-    burst = []
+
+    # Create empty burst SLC with the user-defined start and end-time
     burst1 = BurstSLC()
     burst1.configure()
     burst1.burstNumber = 1
-    burst.append(burst1)
-    
-    # adding the start and end time
-    burst[0].sensingStart=tstart
-    burst[0].sensingStop=tend
-    
-    # add SLC burst to product
-    sentinel1.product.bursts = burst
-
-    # extract the precise orbit information into an orb variable
-    orb = sentinel1.extractPreciseOrbit()
-    
-    # add the state vector information ot the burst SLC product
-    for sv in orb:
+    burst1.sensingStart=tstart
+    burst1.sensingStop=tend
+
+    # add the state vectors from tstart - 60s to tend + 60s, as Sentinel1.extractPreciseOrbit does
+    times, positions, velocities = orbitStore.get_state_vectors(orbitFile, tstart, tend)
+    for time, position, velocity in zip(times, positions, velocities):
+        sv = StateVector()
+        sv.setTime(time)
+        sv.setPosition(position.tolist())
+        sv.setVelocity(velocity.tolist())
         burst1.orbit.addStateVector(sv)
 
     return burst1
     
 
-def topo(burst,time,Range,doppler=0,wvl=0.056):
+def get_zero_doppler():
+    '''Returns the zero doppler polynomial, built once per process'''
+    global zero_doppler
+    if zero_doppler is None:
+        zero_doppler = Poly2D()
+        zero_doppler.initPoly(rangeOrder=1, azimuthOrder=0, coeffs=[[0, 0]])
+    return zero_doppler
+
+def topo(burst,time,Range,doppler=0,wvl=WAVELENGTH):
     '''Function that return the lon lat information for a given time, range, and doppler'''
     
-    ###Planet parameters
-    elp = Planet(pname='Earth').ellipsoid
-    
     # Provide a zero doppler polygon in case 0 is given
-    if doppler is 0:
-        doppler = Poly2D()
-        doppler.initPoly(rangeOrder=1, azimuthOrder=0, coeffs=[[0, 0]])
+    if isinstance(doppler, (int, float)) and doppler == 0:
+        doppler = get_zero_doppler()
 
     # compute the lonlat grid
     latlon = burst.orbit.rdr2geo(time,Range,doppler=doppler, wvl=wvl)
     return latlon
 
+def get_swath(burst, times, nearRange=NEAR_RANGE, farRange=FAR_RANGE, wvl=WAVELENGTH):
+    '''Returns the (n, 3) lat, lon, height arrays of the near range and far range zero doppler
+    points of the burst orbit at each of times. ISCE's rdr2geo takes one point per call, so
+    this is a loop over times that only shares the doppler polynomial between the calls'''
+    doppler = get_zero_doppler()
+    latlon_nearR = np.array([topo(burst, t, nearRange, doppler=doppler, wvl=wvl) for t in times])
+    latlon_farR = np.array([topo(burst, t, farRange, doppler=doppler, wvl=wvl) for t in times])
+    return latlon_nearR, latlon_farR
+
 def plotresults(latlon_outline,satpath):
     
     
@@ -203,70 +141,25 @@ def plotresults(latlon_outline,satpath):
 
 
 def get_plot_data(latlon_outline,satpath):
-    from mpl_toolkits.basemap import Basemap
-    mmap = Basemap(projection='cyl')
-    lat, lon = mmap(latlon_outline[:,1], latlon_outline[:,0])
-    latlon_outline=list(zip(lat,lon))
-    #print("latlon_outline : %s" %latlon_outline)
-    #track_outline = Polygon( latlon_outline, facecolor='blue', edgecolor='blue', alpha=0.2)
-    track_outline = Polygon( latlon_outline)
-
-    #print("track_outline : %s" %track_outline)
-    return latlon_outline
-    #return track_outline
+    '''Returns the outline as a list of (lon, lat), what Basemap(projection='cyl') maps it to'''
+    return list(zip(latlon_outline[:,1], latlon_outline[:,0]))
     
 
 def get_ground_track(tstart, tend, mission, orbit_file, orbitDir): 
 
-
-    
     # generating an Sentinel-1 burst dummy file populated with state vector information for the requested time-period
     burst = S1orbit(tstart,tend,mission,orbit_file, orbitDir)
-    orbit_file = os.path.basename(orbit_file)
-    print("groundTrack : get_ground_track: %s, %s, %s, %s, %s " %(tstart, tend, mission, orbit_file, orbitDir))
+    print("groundTrack : get_ground_track: %s, %s, %s, %s, %s " %(tstart, tend, mission, os.path.basename(orbit_file), orbitDir))
 
-    # constants for S1
-    nearRange = 800e3 #Near range in m
-    farRange = 950e3  #Far range in m
-    doppler = 0       # zero doppler
-    wvl = 0.056       # wavelength
-    
-    # sampling the ground swath (near and far range) in 10 samples
-    latlon_nearR = []
-    latlon_farR = []
-    satpath = []
-    #latlon_geoms = []
+    # sampling the ground swath (near and far range) every second
     delta = (tend - tstart).seconds
     print("delta : %s" %delta)
-    #deltat = np.linspace(0,1, num=int(delta/2))
     deltat = np.linspace(0,1, num=delta)
-    elp = Planet(pname='Earth').ellipsoid
-    for tt in deltat:
-        tinp = tstart + tt * (tend-tstart)
-
-        latlon_nearR_pt = topo(burst,tinp,nearRange,doppler=doppler,wvl=wvl)
-        #print("latlon_nearR_pt : %s " %latlon_nearR_pt)
-        #latlon_nearR.append([latlon_nearR_pt[0], latlon_nearR_pt[1]])
-        latlon_farR_pt = topo(burst,tinp,farRange,doppler=doppler,wvl=wvl)
-        #latlon_farR.append([latlon_farR_pt[0], latlon_farR_pt[1]])
-        #print("latlon_farR_pt : %s " %latlon_farR_pt)        
-        latlon_nearR.append(topo(burst,tinp,nearRange,doppler=doppler,wvl=wvl))
-        latlon_farR.append(topo(burst,tinp,farRange,doppler=doppler,wvl=wvl))
-        satpath.append(elp.xyz_to_llh(burst.orbit.interpolateOrbit(tinp, method='hermite').getPosition()))
-        #latlon_geoms.append( [latlon_nearR_pt, latlon_farR_pt])
-
-    latlon_nearR = np.array(latlon_nearR)
-    latlon_farR = np.array(latlon_farR)
-    satpath = np.array(satpath)
+    times = [tstart + tt * (tend-tstart) for tt in deltat]
+    latlon_nearR, latlon_farR = get_swath(burst, times)
 
     # flip one side such that a polygon can be made by concatenating both.
     latlon_farR=np.flipud(latlon_farR)
     latlon_outline = np.vstack([latlon_nearR,latlon_farR])
-    
-    #print("latlon_outline : %s\n" %latlon_outline)
-    #print("satpath : %s END\n" %satpath)
-    #print("latlon_geoms : %s\n" %latlon_geoms)
-    # plotting the results
-    return get_plot_data(latlon_outline,satpath)
 
-    #return latlon_outline
+    return get_plot_data(latlon_outline,None)
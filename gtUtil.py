@@ -12,6 +12,7 @@ from datetime import datetime, timedelta
 import groundTrack
 from osgeo import ogr, osr
 import lightweight_water_mask
+import geomMemo
 import util
 from util import ACQ
 import urllib.request
@@ -109,12 +110,12 @@ def get_area_from_orbit_file(tstart, tend, mision, orbit_file, orbit_dir, aoi_lo
     intersect, intersection, int_env = util.get_intersection(aoi_location, geojson)
     if intersect:
         logger.info("intersection : %s" %intersection)
-        land_area = lightweight_water_mask.get_land_area(intersection)
-        logger.info("get_land_area(geojson) : %s " %land_area)
-        water_area = lightweight_water_mask.get_water_area(intersection)
+        stats = lightweight_water_mask.get_land_water_stats(intersection)
+        land_area = stats['land_area']
+        water_area = stats['water_area']
+        logger.info("covers_land : %s " %stats['covers_land'])
+        logger.info("covers_water : %s "%stats['covers_water'])
 
-    logger.info("covers_land : %s " %lightweight_water_mask.covers_land(geojson))
-    logger.info("covers_water : %s "%lightweight_water_mask.covers_water(geojson))
     logger.info("get_land_area(geojson) : %s " %land_area)
     logger.info("get_water_area(geojson) : %s " %water_area)    
     
@@ -155,18 +156,41 @@ def get_aoi_area_multipolygon(geojson, aoi_location):
         return get_aoi_area_polygon(geojson, aoi_location)
 
 def get_aoi_area_polygon(geojson, aoi_location):
+    '''Returns the land area, water area and intersection of geojson with the AOI, memoized per geometry pair'''
+    key = geomMemo.geometry_key(geojson, aoi_location, lightweight_water_mask.get_data_version())
+    land_area, water_area, intersection = geomMemo.memoize("aoi_area", key, lambda: list(compute_aoi_area_polygon(geojson, aoi_location)))
+    # callers collect the intersections, keep the memoized one intact
+    return land_area, water_area, copy.deepcopy(intersection)
+
+def compute_aoi_area_polygon(geojson, aoi_location):
     water_area = 0
     land_area = 0
 
+    intersection = get_aoi_intersection(geojson, aoi_location)
+    if intersection is None:
+        return land_area, water_area, None
+    land_area = get_intersection_land_area(intersection)
+    logger.info("get_land_area(geojson) : %s " %land_area)
+    logger.info("get_water_area(geojson) : %s " %water_area)
+
+
+    return land_area, water_area, intersection
+
+def get_aoi_intersection(geojson, aoi_location):
+    '''Returns the intersection of geojson with the AOI as a polygon of its first ring, clockwise, or None'''
     intersect, intersection, int_env = util.get_intersection(aoi_location, geojson)
     if not intersect:
-        return land_area, water_area, None
+        return None
     logger.info("intersection : %s" %intersection)
     if "coordinates" in intersection:
         coordinates = intersection["coordinates"]
         cord =change_coordinate_direction(coordinates[0])
         intersection = {"type":"Polygon", "coordinates": [cord]}
         logger.info("get_aoi_area_polygon : cord : %s" %cord)
+    return intersection
+
+def get_intersection_land_area(intersection):
+    '''Returns the land area of an AOI intersection, retrying with its ring reversed if that fails'''
     try:
         land_area = lightweight_water_mask.get_land_area(intersection)
         logger.info("get_land_area(geojson) : %s " %land_area)
@@ -179,12 +203,49 @@ def get_aoi_area_polygon(geojson, aoi_location):
         
         land_area = lightweight_water_mask.get_land_area(rotated_intersection)
         logger.info("get_land_area(geojson) : %s " %land_area)
-    logger.info("get_land_area(geojson) : %s " %land_area)
-    logger.info("get_water_area(geojson) : %s " %water_area)
+    return land_area
 
 
-    return land_area, water_area, intersection
 
+def get_aoi_area_batch(geojsons, aoi_location):
+    '''get_aoi_area_multipolygon for a list of footprints against the same AOI. The intersections are the
+    ones get_aoi_area_polygon returns, and the land is clipped to the AOI once to measure all of them.
+    Returns a list of (land, water, intersection)'''
+    parts = []
+    for i, geojson in enumerate(geojsons):
+        if geojson["type"] == "MultiPolygon":
+            for cord in geojson["coordinates"]:
+                parts.append((i, {"type":"Polygon", "coordinates": [change_coordinate_direction(cord[0])]}))
+        else:
+            parts.append((i, geojson))
+
+    # the land areas are measured differently from get_aoi_area_polygon's, so they are memoized apart
+    version = lightweight_water_mask.get_data_version()
+    keys = [geomMemo.geometry_key(part, aoi_location, version) for i, part in parts]
+    values = [geomMemo.get("aoi_area_batch", key) for key in keys]
+    missing = [j for j, value in enumerate(values) if value is None]
+    logger.info("get_aoi_area_batch : %s footprints, %s parts, %s to measure" %(len(geojsons), len(parts), len(missing)))
+    if missing:
+        intersections = dict((j, get_aoi_intersection(parts[j][1], aoi_location)) for j in missing)
+        measured = [j for j in missing if intersections[j] is not None]
+        try:
+            land_areas = [land for land, intersection in lightweight_water_mask.get_land_areas_in_aoi(aoi_location, [intersections[j] for j in measured])]
+        except Exception as err:
+            logger.info("get_aoi_area_batch : batch land area failed, measuring the footprints one by one : %s" %err)
+            land_areas = [get_intersection_land_area(intersections[j]) for j in measured]
+        land_areas = dict(zip(measured, land_areas))
+        for j in missing:
+            values[j] = [land_areas.get(j, 0), 0, intersections[j]]
+            geomMemo.put("aoi_area_batch", keys[j], values[j])
+
+    results = []
+    for i, geojson in enumerate(geojsons):
+        owned = [copy.deepcopy(values[j]) for j in range(len(parts)) if parts[j][0] == i]
+        if geojson["type"] == "MultiPolygon":
+            results.append((sum(v[0] for v in owned), sum(v[1] for v in owned), [v[2] for v in owned if v[2]]))
+        else:
+            results.append(tuple(owned[0]))
+    return results
 
 
 def change_coordinate_direction(cord):
@@ -295,9 +356,6 @@ def water_mask_test1(track, orbit_or_track_dt, acq_info, acq_ids,  aoi_location,
             logger.info("Time check Passed")
         
         logger.info("ACQ location : %s" %acq.location)
-        land, water, acq_intersection = get_aoi_area_multipolygon(acq.location, aoi_location)
-        acq_area_array.append(land)
-        logger.info("Area from acq.location : %s" %land)
         polygons.append(acq.location)
 
         if orbit_file:
@@ -308,24 +366,38 @@ def water_mask_test1(track, orbit_or_track_dt, acq_info, acq_ids,  aoi_location,
             logger.info("ACQ_IDDDDD : %s" %acq_id)
             gt_geojson = get_groundTrack_footprint(get_time(acq.starttime), get_time(acq.endtime), mission, orbit_file, orbit_dir)
             gt_polygons.append(gt_geojson)
-            land, water, acq_intersection= get_aoi_area_multipolygon(gt_geojson, aoi_location)
-            logger.info("Area from gt_geojson : %s" %land)
-            gt_area_array.append(land)
 
-    logger.info("Sum of acq.location area : %s" %sum(acq_area_array))
-    logger.info("Sum of gt location area : %s" %sum(gt_area_array))
     total_land = 0
     total_water = 0
    
     logger.info("Calculating Union")
     if orbit_file:
-        ''' First Try Without Orbit File '''
         union_polygon = util.get_union_geometry(polygons)
         #union_polygon = change_coordinate_direction(union_polygon)
         logger.info("Type of union polygon : %s of len %s" %(type(union_polygon["coordinates"]), len(union_polygon["coordinates"])))
+        union_gt_polygon = util.get_union_geometry(gt_polygons)
+        logger.info("union_gt_geojson : %s" %union_gt_polygon)
+
+        #get lowest starttime minus 10 minutes as starttime
+        tstart = getUpdatedTime(sorted(starttimes)[0], -5)
+        logger.info("tstart : %s" %tstart)
+        tend = getUpdatedTime(sorted(endtimes, reverse=True)[0], 5)
+        logger.info("tend : %s" %tend)
+        track_gt_geojson = get_groundTrack_footprint(tstart, tend, mission, orbit_file, orbit_dir)
+        logger.info("track_gt_geojson : %s" %track_gt_geojson)
+
+        # every footprint is measured against the same AOI, so do them in one batch
+        areas = get_aoi_area_batch(polygons + gt_polygons + [union_polygon, union_gt_polygon, track_gt_geojson], aoi_location)
+        acq_area_array = [land for land, water, intersection in areas[:len(polygons)]]
+        gt_area_array = [land for land, water, intersection in areas[len(polygons):len(polygons) + len(gt_polygons)]]
+        logger.info("Area from acq.location : %s" %acq_area_array)
+        logger.info("Area from gt_geojson : %s" %gt_area_array)
+        logger.info("Sum of acq.location area : %s" %sum(acq_area_array))
+        logger.info("Sum of gt location area : %s" %sum(gt_area_array))
 
+        ''' First Try Without Orbit File '''
         logger.info("water_mask_test1 without Orbit File")
-        union_land_no_orbit, union_water_no_orbit, union_intersection_no_orbit  = get_aoi_area_multipolygon(union_polygon, aoi_location)
+        union_land_no_orbit, union_water_no_orbit, union_intersection_no_orbit  = areas[-3]
         logger.info("RESULT : AOI : %s, Track : %s, Date :  %s, Union_Acq_AOI, union_land : %s, union_water : %s, intersection : %s" %(aoi_id, track, orbit_or_track_dt, union_land_no_orbit, union_water_no_orbit, union_intersection_no_orbit))
 
 
@@ -334,23 +406,12 @@ def water_mask_test1(track, orbit_or_track_dt, acq_info, acq_ids,  aoi_location,
 
         ''' Now Try With Orbit File '''
         logger.info("water_mask_test1 with Orbit File")
-        union_gt_polygon = util.get_union_geometry(gt_polygons)
-        logger.info("union_gt_geojson : %s" %union_gt_polygon)
-        union_land, union_water, union_intersection = get_aoi_area_multipolygon(union_gt_polygon, aoi_location)
+        union_land, union_water, union_intersection = areas[-2]
         logger.info("water_mask_test1 with Orbit File: union_land : %s union_water : %s union intersection : %s" %(union_land, union_water, union_intersection))
         result['ACQ_POEORB_AOI_Intersection'] = union_intersection
         result['ACQ_Union_POEORB_Land'] = union_land
-        
-        #get lowest starttime minus 10 minutes as starttime
-        tstart = getUpdatedTime(sorted(starttimes)[0], -5)
-        logger.info("tstart : %s" %tstart)
-        tend = getUpdatedTime(sorted(endtimes, reverse=True)[0], 5)
-        logger.info("tend : %s" %tend)
-        
 
-        track_gt_geojson = get_groundTrack_footprint(tstart, tend, mission, orbit_file, orbit_dir)
-        logger.info("track_gt_geojson : %s" %track_gt_geojson)
-        track_land, track_water, track_intersection = get_aoi_area_multipolygon(track_gt_geojson, aoi_location)
+        track_land, track_water, track_intersection = areas[-1]
         logger.info("water_mask_test1 with Orbit File: track_land : %s track_water : %s intersection : %s" %(track_land, track_water, track_intersection))
         result['Track_POEORB_Land'] = track_land
         result['Track_AOI_Intersection'] = track_intersection
@@ -413,11 +474,12 @@ def get_area_from_acq_location(geojson, aoi_location):
     intersect, intersection, int_env = util.get_intersection(aoi_location, geojson)
     if intersect:
         logger.info("intersection : %s" %intersection)
-        land_area = lightweight_water_mask.get_land_area(intersection)
-        water_area = lightweight_water_mask.get_water_area(intersection)
+        stats = lightweight_water_mask.get_land_water_stats(intersection)
+        land_area = stats['land_area']
+        water_area = stats['water_area']
+        logger.info("covers_land : %s " %stats['covers_land'])
+        logger.info("covers_water : %s "%stats['covers_water'])
 
-    logger.info("covers_land : %s " %lightweight_water_mask.covers_land(geojson))
-    logger.info("covers_water : %s "%lightweight_water_mask.covers_water(geojson))
     logger.info("get_land_area(geojson) : %s " %land_area)
     logger.info("get_water_area(geojson) : %s " %water_area)
 
@@ -14,6 +14,7 @@ from hysds.celery import app
 from hysds.dataset_ingest import ingest
 
 from standard_product_localizer import publish_data, get_acq_object
+import esUtil
 
 
 # set logger
@@ -37,25 +38,28 @@ logger.addFilter(LogFilter())
 def query_es(query, idx, url=app.conf['GRQ_ES_URL']):
     """Query ES index."""
 
-    hits = []
-    url = url[:-1] if url.endswith('/') else url
-    query_url = "{}/{}/_search?search_type=scan&scroll=60&size=100".format(url, idx)
     logger.info("url: {}".format(url))
     logger.info("idx: {}".format(idx))
     logger.info("query: {}".format(json.dumps(query, indent=2)))
-    r = requests.post(query_url, data=json.dumps(query))
-    r.raise_for_status()
-    scan_result = r.json()
-    count = scan_result['hits']['total']
-    if count == 0: return hits
-    scroll_id = scan_result['_scroll_id']
-    while True:
-        r = requests.post('%s/_search/scroll?scroll=60m' % url, data=scroll_id)
-        res = r.json()
-        scroll_id = res['_scroll_id']
-        if len(res['hits']['hits']) == 0: break
-        hits.extend(res['hits']['hits'])
-    return hits
+    return esUtil.query_es(query, idx, url)
+
+
+@backoff.on_exception(backoff.expo, requests.exceptions.RequestException, max_tries=8, max_value=32)
+def find_one(query, idx, url=app.conf['GRQ_ES_URL']):
+    """Return the first hit of a query, or None, without opening a scroll."""
+
+    logger.info("idx: {}".format(idx))
+    logger.info("query: {}".format(json.dumps(query, indent=2)))
+    return esUtil.find_one(query, idx, url)
+
+
+@backoff.on_exception(backoff.expo, requests.exceptions.RequestException, max_tries=8, max_value=32)
+def exists(query, idx, url=app.conf['GRQ_ES_URL']):
+    """Return True if any document matches a query, using _count."""
+
+    logger.info("idx: {}".format(idx))
+    logger.info("query: {}".format(json.dumps(query, indent=2)))
+    return esUtil.exists(query, idx, url)
 
 
 def resolve_acq(slc_id, version):
@@ -73,13 +77,13 @@ def resolve_acq(slc_id, version):
         "fields": [],
     }
     es_index = "grq_{}_acquisition-s1-iw_slc".format(version)
-    result = query_es(query, es_index)
+    result = find_one(query, es_index)
 
-    if len(result) == 0:
+    if result is None:
         raise RuntimeError(
             "Failed to resolve acquisition ID for SLC ID: {}".format(slc_id))
 
-    return result[0]['_id']
+    return result['_id']
 
 
 def all_slcs_exist(acq_ids, acq_version, slc_version):
@@ -183,12 +187,10 @@ def ifgcfg_exists(ifgcfg_id, version):
             "ids": {
                 "values": [ifgcfg_id],
             }
-        },
-        "fields": []
+        }
     }
     index = "grq_{}_ifg-cfg".format(version)
-    result = query_es(query, index)
-    return False if len(result) == 0 else True
+    return exists(query, index)
 
 
 def main():
@@ -200,6 +202,7 @@ def main():
         raise(RuntimeError("Context file doesn't exist."))
     with open(context_file) as f:
         ctx = json.load(f)
+    esUtil.configure(ctx)
 
     # resolve acquisition id from slc id
     slc_id = ctx['slc_id']
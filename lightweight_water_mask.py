@@ -6,41 +6,122 @@ Returns Land/Water percentages for input geojson polygons.
 
 from __future__ import print_function
 import os
+import sys
+import shutil
+import tempfile
+import zipfile
 import json
+import numpy as np
 import pyproj
 from functools import partial
-from shapely.geometry import shape, Polygon, MultiPolygon, mapping
+from shapely.geometry import shape, Polygon, MultiPolygon, mapping, box
 from shapely.ops import cascaded_union
 from shapely.validation import explain_validity
+import shapely.wkb
+from shapely.strtree import STRtree
+from shapely.prepared import prep
+from collections import OrderedDict
 import shapely.ops
 from shapely import speedups
 import fiona
+import geomMemo
 
 speedups.enable()
 land_shapes = False #globals for speed
 water_shapes = False #globals for speed
+shape_indexes = {} #globals for speed, oftype -> (STRtree, {id(shape): position})
+prepared_geoms = OrderedDict() #globals for speed, wkb -> prepared geometry, least recently used first
+PREPARED_CACHE_SIZE = 64
+area_transformer = None #globals for speed
+# equal area projection. This is proj=aea with both standard parallels on the equator, its
+# default, which current PROJ versions reject as degenerate. over keeps longitudes past 180
+# as they are, so polygons across the antimeridian are not torn in two
+AREA_PROJ = {'proj': 'cea', 'over': True}
+ENGINES = ('polygon', 'raster')
+ENGINE = 'polygon' # land area engine, see configure()
+land_fraction = None #globals for speed, memory mapped land fraction grid
+LAND_FRACTION_RES = 1.0 / 60 # grid cell size in degrees when building the grid
+LAND_FRACTION_SUPERSAMPLE = 8 # sub-cells per cell side sampled when building the grid
+QUERY_SUPERSAMPLE = 4 # sub-cells per cell side sampled when rasterizing a query
+tile_stores = {} #globals for speed, oftype -> OrderedDict (ix, iy) -> (state, clipped shapes), least recently used first
+tile_caches = {} #globals for speed, oftype -> memory mapped arrays of the tile store, or None
+TILE_SIZE = 1 # degrees
+TILE_COLS, TILE_ROWS = 360 // TILE_SIZE, 180 // TILE_SIZE
+TILE_BLOCK = 8 # tiles per side clipped together when there is no tile store
+TILE_CACHE_SIZE = 4096 # tiles per type kept as geometries
+TILE_EMPTY, TILE_FULL, TILE_MIXED = 0, 1, 2
+WGS84_A = 6378137.0 # semi-major axis in m
+WGS84_E2 = 6.69437999014e-3 # first eccentricity squared
 
-def covers_land(geojson):
-    '''Determines if there is any land over the geojson. Returns True or False'''
+def load_shapes(oftype='land'):
+    '''Returns the land or water shapes, read from the shapefile once per process'''
+    global land_shapes, water_shapes
+    if oftype == 'land':
+        if not land_shapes:
+            land_shapes = get_shapes(oftype='land')
+        return land_shapes
+    if not water_shapes:
+        water_shapes = get_shapes(oftype='water')
+    return water_shapes
+
+def get_index(oftype='land'):
+    '''Returns the STRtree over the land or water shapes, built once per process'''
+    if oftype not in shape_indexes:
+        shapes = load_shapes(oftype)
+        shape_indexes[oftype] = (STRtree(shapes), dict((id(shp), i) for i, shp in enumerate(shapes)))
+    return shape_indexes[oftype]
+
+def get_candidates(geom, oftype='land'):
+    '''Returns the land or water shapes whose bounding box intersects geom, in shapefile order'''
+    tree, positions = get_index(oftype)
+    return query_tree(tree, positions, load_shapes(oftype), geom)
+
+def query_tree(tree, positions, shapes, geom):
+    '''Returns the shapes, indexed by tree, whose bounding box intersects geom, in their order'''
+    if tree is None:
+        return []
+    found = tree.query(geom)
+    if len(found) == 0:
+        return []
+    if hasattr(found[0], 'geom_type'): # shapely < 2.0 returns the geometries, not their positions
+        found = [positions[id(shp)] for shp in found]
+    return [shapes[i] for i in sorted(found)]
+
+def get_prepared(geom):
+    '''Returns geom as a prepared geometry, reusing the one made for an identical geometry in an earlier call'''
+    key = geom.wkb
+    prepared = prepared_geoms.pop(key, None)
+    if prepared is None:
+        prepared = prep(geom)
+        if len(prepared_geoms) >= PREPARED_CACHE_SIZE:
+            prepared_geoms.popitem(last=False)
+    prepared_geoms[key] = prepared
+    return prepared
+
+def covers(geojson, oftype='land'):
+    '''Determines if there is any land or water over the geojson, from the tiles. Returns True or False'''
     geojson = validate_geojson(geojson)
-    global land_shapes
-    if not land_shapes:
-        land_shapes = get_shapes(oftype='land')
-    for shapeobj in land_shapes:
-        if shapeobj.intersects(geojson):
-            return True
+    if geojson.is_empty:
+        return False
+    prepared = get_prepared(geojson)
+    for ix, iy in get_tile_range(geojson):
+        state, tile_shapes = get_tile(ix, iy, oftype=oftype)
+        if state == TILE_FULL:
+            if prepared.intersects(get_tile_box(ix, iy)):
+                return True
+        elif state == TILE_MIXED:
+            for shapeobj in tile_shapes:
+                if prepared.intersects(shapeobj):
+                    return True
     return False
 
+def covers_land(geojson):
+    '''Determines if there is any land over the geojson. Returns True or False'''
+    return covers(geojson, oftype='land')
+
 def covers_water(geojson):
     '''Determines if there is any water over the geojson. Returns True or False'''
-    geojson = validate_geojson(geojson)
-    global water_shapes
-    if not water_shapes:
-        water_shapes = get_shapes(oftype='water')
-    for shapeobj in water_shapes:
-        if shapeobj.intersects(geojson):
-            return True
-    return False
+    return covers(geojson, oftype='water')
 
 def covers_only_land(geojson):
     '''returns True if the geojson only covers land, False if there is any water in the scene'''
@@ -50,26 +131,108 @@ def covers_only_water(geojson):
     '''returns True if the geojson only covers water, False if there is any land in the scene'''
     return not covers_land(geojson)
 
+def configure(ctx):
+    '''Sets the land area engine from the water_mask_engine context key, polygon or raster, and the land area memo'''
+    global ENGINE
+    geomMemo.configure(ctx)
+    engine = ctx.get('water_mask_engine')
+    if engine is None or str(engine).strip() == '':
+        return
+    engine = str(engine).strip()
+    if engine not in ENGINES:
+        raise Exception('Unknown water mask engine {0}, expected one of {1}'.format(engine, ', '.join(ENGINES)))
+    ENGINE = engine
+    print('Water mask engine: {0}'.format(ENGINE))
+
+def get_data_version():
+    '''Returns the engine and the mtime of the land data it reads, so memoized areas follow data updates'''
+    data_file = get_land_fraction_file() if ENGINE == 'raster' else get_shapefile('land')
+    if not os.path.exists(data_file):
+        data_file = get_shape_cache('land')
+    return '{0}:{1}:{2}'.format(ENGINE, os.path.getmtime(data_file) if os.path.exists(data_file) else 0, sorted(AREA_PROJ.items()))
+
 def get_land_area(geojson):
-    '''returns the amount of land covering the geojson in km^2'''
+    '''returns the amount of land covering the geojson in km^2, memoized per geometry'''
+    geojson = validate_geojson(geojson)
+    key = geomMemo.geometry_key(geojson, get_data_version())
+    return geomMemo.memoize('land_area', key, partial(compute_land_area, geojson))
+
+def compute_land_area(geojson):
+    '''returns the amount of land covering the geojson in km^2 with the configured engine'''
+    if ENGINE == 'raster':
+        return get_land_area_raster(geojson)
+    area, intersecting_land_shapes = clip_land(geojson, analytic=True)
+    # land shapes do not overlap, so the pieces can be measured in one batch and summed
+    return area + sum(get_areas(intersecting_land_shapes))
+
+def clip_land(geojson, analytic=False, oftype='land'):
+    '''Returns (area, pieces), the land (or water) inside the geojson as non-overlapping polygons. With
+    analytic, the full tiles inside the geojson are added up in area, in km^2, instead of returned as pieces'''
     geojson = validate_geojson(geojson)
-    global land_shapes
-    if not land_shapes:
-        land_shapes = get_shapes(oftype='land')
+    if geojson.is_empty:
+        return 0.0, []
+    prepared = get_prepared(geojson)
+    area = 0.0
     intersecting_land_shapes = []
-    for shapeobj in land_shapes:
-        if shapeobj.intersects(geojson) or geojson.contains(shapeobj):
-            if shapeobj.contains(geojson):
-                return get_area(geojson)
-            intersecting_land_shapes.append(geojson.intersection(shapeobj))
-    area = get_area(MultiPolygon(intersecting_land_shapes))
-    return area
+    full_tiles = []
+    for ix, iy in get_tile_range(geojson):
+        state, tile_shapes = get_tile(ix, iy, oftype=oftype)
+        if state == TILE_EMPTY:
+            continue
+        tile = get_tile_box(ix, iy)
+        if not prepared.intersects(tile):
+            continue
+        if prepared.contains(tile): # the whole tile counts
+            if state != TILE_FULL:
+                intersecting_land_shapes.extend(tile_shapes)
+            elif analytic:
+                area += get_tile_area(iy)
+            else:
+                full_tiles.append(tile)
+        elif state == TILE_FULL:
+            full_tiles.append(tile)
+        else:
+            for shapeobj in tile_shapes:
+                if prepared.intersects(shapeobj):
+                    intersecting_land_shapes.extend(get_polygonal(shapeobj if prepared.contains(shapeobj) else geojson.intersection(shapeobj)))
+    if len(full_tiles) > 0:
+        # clip the geojson to the full tiles in one go, so its edges are not cut where two of them meet
+        intersecting_land_shapes.extend(get_polygonal(geojson.intersection(shapely.ops.unary_union(full_tiles))))
+    return area, intersecting_land_shapes
+
+def get_land_areas_in_aoi(aoi, geojsons):
+    '''Returns a list of (land area in km^2, intersection) of each geojson with the aoi, the intersection
+    as a shapely geometry or None if they do not intersect. The land is clipped to the aoi once and each
+    intersection is only measured against those pieces'''
+    aoi = validate_geojson(aoi)
+    if ENGINE == 'raster':
+        aoi_land = []
+    else:
+        aoi_land = clip_land(aoi)[1]
+    tree = STRtree(aoi_land) if len(aoi_land) > 0 else None
+    positions = dict((id(shp), i) for i, shp in enumerate(aoi_land))
+    results = []
+    for geojson in geojsons:
+        intersection = aoi.intersection(validate_geojson(geojson))
+        intersection = shapely.ops.unary_union(get_polygonal(intersection))
+        if intersection.is_empty:
+            results.append((0.0, None))
+            continue
+        if ENGINE == 'raster':
+            results.append((get_land_area(intersection), intersection))
+            continue
+        prepared = get_prepared(intersection)
+        pieces = []
+        for shapeobj in query_tree(tree, positions, aoi_land, intersection):
+            if prepared.intersects(shapeobj):
+                pieces.append(shapeobj if prepared.contains(shapeobj) else intersection.intersection(shapeobj))
+        results.append((sum(get_areas(pieces)), intersection))
+    return results
 
 def get_water_area(geojson):
     '''Returns the amount of water covering the geojson in km^2'''
     geojson = validate_geojson(geojson)
-    land = get_land_area(geojson)
-    return get_area(shape(geojson)) - land
+    return get_area(geojson) - get_land_area(geojson)
 
 def get_land_percentage(geojson):
     '''Returns the percentage of area covered by land. 0.0 to 1.0'''
@@ -81,21 +244,35 @@ def get_water_percentage(geojson):
     geojson = validate_geojson(geojson)
     return get_water_area(geojson) / get_area(geojson)
 
+def get_land_water_stats(geojson):
+    '''Returns a dict of land_area, water_area and total_area in km^2, land_percentage, water_percentage,
+    covers_land and covers_water for the geojson, validated, projected and intersected once. Memoized per geometry'''
+    geojson = validate_geojson(geojson)
+    key = geomMemo.geometry_key(geojson, get_data_version())
+    return dict(geomMemo.memoize('land_water_stats', key, partial(compute_land_water_stats, geojson)))
+
+def compute_land_water_stats(geojson):
+    '''Computes get_land_water_stats for a validated geometry'''
+    total_area = get_area(geojson)
+    land_area = get_land_area(geojson)
+    water_area = total_area - land_area
+    return {'land_area': land_area,
+            'water_area': water_area,
+            'total_area': total_area,
+            'land_percentage': land_area / total_area if total_area > 0 else 0.0,
+            'water_percentage': water_area / total_area if total_area > 0 else 0.0,
+            # a geojson that only touches land has no land area, so that case still needs the predicate
+            'covers_land': bool(land_area > 0 or covers_land(geojson)),
+            'covers_water': bool(covers_water(geojson))}
+
 def get_polygons(geojson, oftype='land'):
     '''returns a list of land area polygons that intersect the input geojson, for either land or water, cropped to the input geojson extent'''
-    intersecting_shapes = []
-    geojson = validate_geojson(geojson)
-    landwater_shapes = get_shapes(oftype=oftype)
-    for shapeobj in landwater_shapes:
-        if shapeobj.intersects(geojson):
-            if shapeobj.contains(geojson):
-                return mapping(geojson)
-            intrsct = geojson.intersection(shapeobj)
-            intersecting_shapes.append(intrsct)
+    intersecting_shapes = clip_land(geojson, oftype=oftype)[1]
     if len(intersecting_shapes) == 0:
         return None
     if len(intersecting_shapes) == 1:
         return mapping(intersecting_shapes[0])
+    # rejoin the pieces cut at tile edges
     multi = MultiPolygon(intersecting_shapes)
     return mapping(cascaded_union(multi))
 
@@ -107,16 +284,234 @@ def get_water_polygons(geojson):
     '''returns a list of water area polygons that intersect the input geojson, cropped to the input geojson extent'''
     return get_polygons(geojson, oftype='water')
 
+def get_transformer():
+    '''Returns the lon/lat to equal area Transformer, built once per process. None with pyproj < 2.1'''
+    global area_transformer
+    if area_transformer is None and hasattr(pyproj, 'Transformer'):
+        area_transformer = pyproj.Transformer.from_crs(pyproj.CRS('EPSG:4326'), pyproj.CRS(**AREA_PROJ), always_xy=True)
+    return area_transformer
+
+def get_rings(geom):
+    '''Yields (coordinates array, sign) for every ring of a polygonal geometry, -1 for holes'''
+    if geom.is_empty:
+        return
+    if geom.geom_type == 'Polygon':
+        yield np.asarray(geom.exterior.coords)[:, :2], 1
+        for interior in geom.interiors:
+            yield np.asarray(interior.coords)[:, :2], -1
+    elif hasattr(geom, 'geoms'):
+        for part in geom.geoms:
+            for ring in get_rings(part):
+                yield ring
+
 def get_area(geojson):
     '''Returns the area of the polygon'''
-    geojson = validate_geojson(geojson)
-    newshape = shapely.ops.transform(partial(pyproj.transform, pyproj.Proj(init='EPSG:4326'),
-                                     pyproj.Proj(proj='aea')), geojson)
-    return newshape.area / 10.0**6
+    return get_areas([geojson])[0]
+
+def get_areas(geojsons):
+    '''Returns the areas of a list of polygons in km^2, projecting all their coordinates in one call'''
+    geoms = [validate_geojson(geojson) for geojson in geojsons]
+    transformer = get_transformer()
+    if transformer is None:
+        proj = partial(pyproj.transform, pyproj.Proj(init='EPSG:4326'), pyproj.Proj(**AREA_PROJ))
+        return [shapely.ops.transform(proj, geom).area / 10.0**6 for geom in geoms]
+    rings, signs, owners = [], [], []
+    for i, geom in enumerate(geoms):
+        for coords, sign in get_rings(geom):
+            rings.append(coords)
+            signs.append(sign)
+            owners.append(i)
+    areas = np.zeros(len(geoms))
+    if len(rings) == 0:
+        return areas.tolist()
+    coords = np.concatenate(rings)
+    x, y = transformer.transform(coords[:, 0], coords[:, 1])
+    # shoelace terms, zeroed where they would join the last point of a ring to the first of the next
+    cross = np.append(x[:-1] * y[1:] - x[1:] * y[:-1], 0.0)
+    starts = np.cumsum([0] + [len(ring) for ring in rings[:-1]])
+    cross[starts[1:] - 1] = 0.0
+    ring_areas = np.abs(np.add.reduceat(cross, starts)) / 2.0
+    np.add.at(areas, owners, np.array(signs) * ring_areas)
+    return (areas / 10.0**6).tolist()
+
+def get_tile_box(ix, iy):
+    '''Returns the box of tile ix, iy, counted in TILE_SIZE steps east of -180 and north of -90'''
+    west, south = -180 + ix * TILE_SIZE, -90 + iy * TILE_SIZE
+    return box(west, south, west + TILE_SIZE, south + TILE_SIZE)
+
+def get_tile_range(geom):
+    '''Yields the ix, iy of the tiles under the bounding box of geom. Like the shapes, tiles stop at the antimeridian'''
+    minx, miny, maxx, maxy = geom.bounds
+    for ix in range(max(0, int(np.floor((minx + 180) / TILE_SIZE))), min(TILE_COLS, int(np.ceil((maxx + 180) / TILE_SIZE)))):
+        for iy in range(max(0, int(np.floor((miny + 90) / TILE_SIZE))), min(TILE_ROWS, int(np.ceil((maxy + 90) / TILE_SIZE)))):
+            yield ix, iy
+
+def get_tile_area(iy):
+    '''Returns the km^2 area of a tile in row iy'''
+    return get_cell_areas(TILE_SIZE, TILE_ROWS - 1 - iy, TILE_ROWS - iy)[0]
+
+def get_polygonal(geom):
+    '''Returns the polygons of geom, dropping the points and lines an intersection can leave'''
+    if geom.is_empty:
+        return []
+    if geom.geom_type == 'Polygon':
+        return [geom]
+    if hasattr(geom, 'geoms'):
+        return [poly for part in geom.geoms for poly in get_polygonal(part)]
+    return []
+
+def clip_tiles(shapes, ix0, iy0, ix1, iy1, tiles):
+    '''Clips shapes to the tiles ix0 <= ix < ix1, iy0 <= iy < iy1 and stores each tile's state and
+    pieces in tiles. Halves the range until single tiles remain, so every clip is against shapes
+    already cut down to the enclosing range'''
+    region = box(-180 + ix0 * TILE_SIZE, -90 + iy0 * TILE_SIZE, -180 + ix1 * TILE_SIZE, -90 + iy1 * TILE_SIZE)
+    prepared = prep(region)
+    clipped = []
+    for shapeobj in shapes:
+        if prepared.intersects(shapeobj):
+            clipped.extend(get_polygonal(shapeobj if prepared.contains(shapeobj) else region.intersection(shapeobj)))
+    if len(clipped) == 0:
+        for ix in range(ix0, ix1):
+            for iy in range(iy0, iy1):
+                tiles[(ix, iy)] = (TILE_EMPTY, [])
+    elif ix1 - ix0 == 1 and iy1 - iy0 == 1:
+        # shapes do not overlap, so they fill the tile when their areas add up to it
+        if sum(piece.area for piece in clipped) >= region.area * (1 - 1e-9):
+            tiles[(ix0, iy0)] = (TILE_FULL, [])
+        else:
+            tiles[(ix0, iy0)] = (TILE_MIXED, clipped)
+    elif ix1 - ix0 >= iy1 - iy0:
+        mid = (ix0 + ix1) // 2
+        clip_tiles(clipped, ix0, iy0, mid, iy1, tiles)
+        clip_tiles(clipped, mid, iy0, ix1, iy1, tiles)
+    else:
+        mid = (iy0 + iy1) // 2
+        clip_tiles(clipped, ix0, iy0, ix1, mid, tiles)
+        clip_tiles(clipped, ix0, mid, ix1, iy1, tiles)
+
+def get_tile(ix, iy, oftype='land'):
+    '''Returns the state of tile ix, iy, TILE_EMPTY, TILE_FULL or TILE_MIXED, and for mixed tiles the
+    land or water shapes clipped to it. Read from the tile store, or clipped on first use. Only the
+    TILE_CACHE_SIZE most recently used tiles are kept as geometries'''
+    tiles = tile_stores.setdefault(oftype, OrderedDict())
+    tile = tiles.pop((ix, iy), None)
+    if tile is None:
+        store = load_tile_cache(oftype)
+        if store is not None:
+            tile = read_tile(store, ix, iy)
+        else: # clip the whole block around the tile, its neighbours are likely to be asked for next
+            ix0, iy0 = ix - ix % TILE_BLOCK, iy - iy % TILE_BLOCK
+            ix1, iy1 = min(TILE_COLS, ix0 + TILE_BLOCK), min(TILE_ROWS, iy0 + TILE_BLOCK)
+            block = box(-180 + ix0 * TILE_SIZE, -90 + iy0 * TILE_SIZE, -180 + ix1 * TILE_SIZE, -90 + iy1 * TILE_SIZE)
+            clip_tiles(get_candidates(block, oftype), ix0, iy0, ix1, iy1, tiles)
+            tile = tiles.pop((ix, iy))
+    tiles[(ix, iy)] = tile
+    while len(tiles) > TILE_CACHE_SIZE:
+        tiles.popitem(last=False)
+    return tile
+
+def read_tile(store, ix, iy):
+    '''Makes the polygons of tile ix, iy from the flat arrays of the tile store'''
+    k = ix * TILE_ROWS + iy
+    tile_polygons, polygon_rings, ring_offsets, coords = store['tile_polygons'], store['polygon_rings'], store['ring_offsets'], store['coords']
+    polygons = []
+    for p in range(tile_polygons[k], tile_polygons[k + 1]):
+        rings = [coords[ring_offsets[r]:ring_offsets[r + 1]] for r in range(polygon_rings[p], polygon_rings[p + 1])]
+        polygons.append(Polygon(rings[0], rings[1:]))
+    return int(store['states'][ix, iy]), polygons
+
+def get_tile_cache(oftype='land'):
+    '''Returns the directory of the tile store of the land or water shapes'''
+    return os.path.splitext(get_shapefile(oftype))[0] + '_tiles'
+
+def write_tile_cache(oftype='land'):
+    '''Clips all the shapes to the tiles and writes the tile store: a directory of .npy arrays, the
+    tile states and the vertices of every piece, flat, with ring, polygon and tile offsets into them.
+    Processes memory map it, so a pool of workers shares one copy in the page cache'''
+    tiles = {}
+    clip_tiles(load_shapes(oftype), 0, 0, TILE_COLS, TILE_ROWS, tiles)
+    states = np.zeros((TILE_COLS, TILE_ROWS), dtype=np.int8)
+    tile_polygons = np.zeros(TILE_COLS * TILE_ROWS + 1, dtype=np.int64)
+    polygon_rings, ring_offsets, coords = [0], [0], []
+    for ix in range(TILE_COLS):
+        for iy in range(TILE_ROWS):
+            state, pieces = tiles[(ix, iy)]
+            states[ix, iy] = state
+            for piece in pieces:
+                for ring in [piece.exterior] + list(piece.interiors):
+                    coords.append(np.asarray(ring.coords)[:, :2])
+                    ring_offsets.append(ring_offsets[-1] + len(coords[-1]))
+                polygon_rings.append(len(ring_offsets) - 1)
+            tile_polygons[ix * TILE_ROWS + iy + 1] = len(polygon_rings) - 1
+    arrays = {'states': states, 'tile_polygons': tile_polygons,
+              'polygon_rings': np.array(polygon_rings, dtype=np.int64),
+              'ring_offsets': np.array(ring_offsets, dtype=np.int64),
+              'coords': np.concatenate(coords) if len(coords) > 0 else np.zeros((0, 2)),
+              'source_mtime': np.float64(os.path.getmtime(get_shapefile(oftype)))}
+    # each store is written to its own version directory and the cache path is a symlink that is
+    # switched to it with one rename, so a worker loading the store reads one version or the other
+    cache = get_tile_cache(oftype)
+    cache_dir, cache_name = os.path.split(cache)
+    version = tempfile.mkdtemp(prefix=cache_name + '.', dir=cache_dir)
+    os.chmod(version, 0o755)
+    for name, array in arrays.items():
+        np.save(os.path.join(version, name + '.npy'), array)
+    previous = os.path.realpath(cache) if os.path.islink(cache) else None
+    link = version + '.link'
+    os.symlink(os.path.basename(version), link)
+    if os.path.isdir(cache) and not os.path.islink(cache): # a store written before the symlink, once
+        os.rename(cache, cache + '.old')
+    os.replace(link, cache)
+    # the version just replaced is kept for workers still loading it, older ones are removed.
+    # processes that mapped a removed version keep reading its unlinked files
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith(cache_name + '.') and path not in (version, previous):
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.islink(path):
+                os.remove(path)
+    tile_caches.pop(oftype, None)
+    tile_stores.pop(oftype, None)
+    return cache
+
+def load_tile_cache(oftype='land'):
+    '''Returns the tile store arrays, memory mapped once per process, or None if it is missing or older than the shapefile'''
+    if oftype not in tile_caches:
+        # resolve the symlink once, so every array comes from the same version of the store
+        cache = os.path.realpath(get_tile_cache(oftype))
+        shapefile = get_shapefile(oftype)
+        tile_caches[oftype] = None
+        if os.path.exists(os.path.join(cache, 'source_mtime.npy')):
+            source_mtime = float(np.load(os.path.join(cache, 'source_mtime.npy')))
+            if not (os.path.exists(shapefile) and os.path.getmtime(shapefile) > source_mtime):
+                tile_caches[oftype] = dict((name, np.load(os.path.join(cache, name + '.npy'), mmap_mode='r'))
+                                           for name in ('states', 'tile_polygons', 'polygon_rings', 'ring_offsets', 'coords'))
+    return tile_caches[oftype]
+
+def get_shapefile(oftype='land'):
+    '''Returns the path of the land or water shapefile'''
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'simplified_{0}_polygons.shp'.format(oftype))
+
+def get_shape_cache(oftype='land'):
+    '''Returns the path of the binary cache of the validated land or water shapes'''
+    return os.path.splitext(get_shapefile(oftype))[0] + '.npz'
 
 def get_shapes(oftype='land'):
-    '''loads all the shapes from the water shapefile'''
-    shapefile = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'simplified_{0}_polygons.shp'.format(oftype))
+    '''loads all the shapes from the water shapefile, from its binary cache if that is up to date'''
+    shapes = load_shape_cache(oftype)
+    if shapes is not None:
+        return shapes
+    shapes = read_shapefile(oftype)
+    try:
+        write_shape_cache(oftype, shapes)
+    except (IOError, OSError) as err:
+        print('Could not write shape cache {0}: {1}'.format(get_shape_cache(oftype), err))
+    return shapes
+
+def read_shapefile(oftype='land'):
+    '''parses and validates all the shapes of the shapefile'''
+    shapefile = get_shapefile(oftype)
     shapes = []
     if not os.path.exists(shapefile):
         raise Exception('Required data file does not exist: {0}'.format(shapefile))
@@ -126,6 +521,159 @@ def get_shapes(oftype='land'):
             shapes.append(sp)
     return shapes
 
+def write_shape_cache(oftype, shapes):
+    '''Writes the validated shapes as one WKB blob with offsets, plus the shapefile mtime'''
+    blobs = [shp.wkb for shp in shapes]
+    offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in blobs])
+    cache = get_shape_cache(oftype)
+    # a temp file of its own, so workers building the cache at once do not write over each other
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(cache), suffix='.tmp.npz', delete=False) as tmp:
+        np.savez(tmp, wkb=np.frombuffer(b''.join(blobs), dtype=np.uint8), offsets=offsets,
+                 source_mtime=np.float64(os.path.getmtime(get_shapefile(oftype))))
+    os.chmod(tmp.name, 0o644)
+    os.rename(tmp.name, cache)
+    return cache
+
+def load_shape_cache(oftype='land'):
+    '''Returns the shapes from the binary cache, or None if it is missing, unreadable or older than the shapefile'''
+    cache = get_shape_cache(oftype)
+    shapefile = get_shapefile(oftype)
+    if not os.path.exists(cache):
+        return None
+    try:
+        with np.load(cache) as data:
+            if os.path.exists(shapefile) and os.path.getmtime(shapefile) > float(data['source_mtime']):
+                return None
+            blob = data['wkb'].tobytes()
+            offsets = data['offsets']
+    except (IOError, OSError, ValueError, KeyError, zipfile.BadZipfile) as err:
+        print('Ignoring shape cache {0}: {1}'.format(cache, err))
+        return None
+    return [shapely.wkb.loads(blob[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]
+
+def build_shape_cache():
+    '''Build step: writes the binary caches and the tile stores of the land and water shapefiles'''
+    for oftype in ('land', 'water'):
+        print('Wrote {0}'.format(write_shape_cache(oftype, read_shapefile(oftype))))
+        print('Wrote {0}'.format(write_tile_cache(oftype)))
+
+def get_land_fraction_file():
+    '''Returns the path of the land fraction grid'''
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'land_fraction.npy')
+
+def load_land_fraction():
+    '''Returns the land fraction grid, memory mapped once per process. Row 0 is the cell
+    north of 90 - res, column 0 the cell east of -180, values are land fractions * 255'''
+    global land_fraction
+    if land_fraction is None:
+        grid_file = get_land_fraction_file()
+        if not os.path.exists(grid_file):
+            raise Exception('Required data file does not exist: {0}, build it with --build-grid'.format(grid_file))
+        land_fraction = np.load(grid_file, mmap_mode='r')
+    return land_fraction
+
+def get_edges(geom):
+    '''Returns the x0, y0, x1, y1 arrays of the edges of every ring of a polygonal geometry'''
+    edges = [np.column_stack((coords[:-1], coords[1:])) for coords, sign in get_rings(geom)]
+    if len(edges) == 0:
+        return np.zeros((4, 0))
+    return np.concatenate(edges).T
+
+def rasterize(geom, west, north, res, ny, nx):
+    '''Returns the (ny, nx) boolean mask of the res degree cells, counted from the (west, north)
+    corner, whose center is inside geom. Scanline fill with the even-odd rule, so holes are excluded'''
+    mask = np.zeros((ny, nx), dtype=bool)
+    x0, y0, x1, y1 = get_edges(geom)
+    if len(x0) == 0:
+        return mask
+    minx, miny, maxx, maxy = geom.bounds
+    row_start = max(0, int(np.floor((north - maxy) / res - 0.5)))
+    row_end = min(ny, int(np.ceil((north - miny) / res - 0.5)) + 1)
+    col_start = max(0, int(np.floor((minx - west) / res - 0.5)))
+    col_end = min(nx, int(np.ceil((maxx - west) / res - 0.5)) + 1)
+    width = col_end - col_start
+    if row_start >= row_end or width <= 0:
+        return mask
+    ylo, yhi = np.minimum(y0, y1), np.maximum(y0, y1)
+    for row in range(row_start, row_end):
+        yc = north - (row + 0.5) * res
+        crossing = (ylo <= yc) & (yhi > yc) # half open, so vertices and horizontal edges count once
+        if not crossing.any():
+            continue
+        xa, ya, xb, yb = x0[crossing], y0[crossing], x1[crossing], y1[crossing]
+        xs = np.sort(xa + (yc - ya) * (xb - xa) / (yb - ya))
+        # cells whose center is in [xs[2k], xs[2k + 1]) are inside
+        starts = np.clip(np.ceil((xs[0::2] - west) / res - 0.5).astype(int) - col_start, 0, width)
+        ends = np.clip(np.ceil((xs[1::2] - west) / res - 0.5).astype(int) - col_start, 0, width)
+        fill = np.zeros(width + 1, dtype=int)
+        np.add.at(fill, starts, 1)
+        np.add.at(fill, ends, -1)
+        mask[row, col_start:col_end] = np.cumsum(fill[:-1]) > 0
+    return mask
+
+def get_cell_areas(res, row_start, row_end):
+    '''Returns the km^2 area of a res degree cell in each grid row, on the WGS84 ellipsoid like get_areas.
+    This is the cos(lat) weight integrated over the cell, with the ellipsoid's authalic correction'''
+    e = np.sqrt(WGS84_E2)
+    def q(lat):
+        sin = np.sin(np.radians(lat))
+        return sin / (1 - WGS84_E2 * sin ** 2) + np.log((1 + e * sin) / (1 - e * sin)) / (2 * e)
+    north = 90.0 - np.arange(row_start, row_end) * res
+    return WGS84_A ** 2 * (1 - WGS84_E2) / 2 * np.radians(res) * (q(north) - q(north - res)) / 10.0**6
+
+def get_land_area_raster(geojson):
+    '''Returns the amount of land covering the geojson in km^2, estimated from the land fraction grid:
+    the fraction of each cell covered by the geojson times its land fraction and its area'''
+    geojson = validate_geojson(geojson)
+    if geojson.is_empty:
+        return 0.0
+    grid = load_land_fraction()
+    rows, cols = grid.shape
+    res = 360.0 / cols
+    minx, miny, maxx, maxy = geojson.bounds
+    # like the land shapes, the grid stops at the antimeridian, so longitudes past it hold no land
+    col_start, col_end = max(0, int(np.floor((minx + 180.0) / res))), min(cols, int(np.ceil((maxx + 180.0) / res)))
+    row_start, row_end = max(0, int(np.floor((90.0 - maxy) / res))), min(rows, int(np.ceil((90.0 - miny) / res)))
+    if col_start >= col_end or row_start >= row_end:
+        return 0.0
+    s = QUERY_SUPERSAMPLE
+    ny, nx = row_end - row_start, col_end - col_start
+    covered = rasterize(geojson, -180.0 + col_start * res, 90.0 - row_start * res, res / s, ny * s, nx * s)
+    coverage = covered.reshape(ny, s, nx, s).mean(axis=(1, 3))
+    fraction = grid[row_start:row_end, col_start:col_end] / 255.0
+    return float(np.sum(coverage * fraction * get_cell_areas(res, row_start, row_end)[:, np.newaxis]))
+
+def build_land_fraction(res=LAND_FRACTION_RES, supersample=LAND_FRACTION_SUPERSAMPLE, band=30):
+    '''Build step: writes the land fraction grid, sampling supersample^2 points of each cell against
+    the land shapes, band grid rows at a time'''
+    cols, rows = int(round(360.0 / res)), int(round(180.0 / res))
+    res = 360.0 / cols
+    grid_file = get_land_fraction_file()
+    tmp = grid_file + '.tmp.npy'
+    grid = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.uint8, shape=(rows, cols))
+    s = supersample
+    sres = res / s
+    for row_start in range(0, rows, band):
+        row_end = min(rows, row_start + band)
+        north, south = 90.0 - row_start * res, 90.0 - row_end * res
+        land = np.zeros(((row_end - row_start) * s, cols * s), dtype=bool)
+        for shapeobj in get_candidates(Polygon([(-180, south), (180, south), (180, north), (-180, north)]), oftype='land'):
+            # only the sub-cells of the shape's bounds, land shapes do not overlap so their masks can be or'ed together
+            minx, miny, maxx, maxy = shapeobj.bounds
+            r0, r1 = max(0, int(np.floor((north - maxy) / sres))), min(land.shape[0], int(np.ceil((north - miny) / sres)) + 1)
+            c0, c1 = max(0, int(np.floor((minx + 180.0) / sres))), min(land.shape[1], int(np.ceil((maxx + 180.0) / sres)) + 1)
+            if r0 >= r1 or c0 >= c1:
+                continue
+            land[r0:r1, c0:c1] |= rasterize(shapeobj, -180.0 + c0 * sres, north - r0 * sres, sres, r1 - r0, c1 - c0)
+        counts = land.reshape(row_end - row_start, s, cols, s).sum(axis=(1, 3))
+        grid[row_start:row_end] = np.round(counts * 255.0 / (s * s)).astype(np.uint8)
+    grid.flush()
+    del grid
+    os.rename(tmp, grid_file)
+    print('Wrote {0}'.format(grid_file))
+    return grid_file
+
 
 def validate_geojson(geojson):
     '''validates the geojson and converts it into a shapely object. can accept strings, shapefiles & geojson dicts'''
@@ -173,37 +721,44 @@ def comparison(input_val, comparison_val):
         return failed
     return passed
          
-def test():
-    '''runs a test over sicily, hawaii, etc'''
-    test_dict = {}
-    result = {}
-    test_dict['land_and_water_polygon'] = [[12.891683578491213, 38.37789851200675], [11.765542030334474, 38.11254460084754], [12.869324684143068, 37.133463744616456], [14.642543792724611, 36.54194981843648], [15.757741928100588, 36.6001975253107], [15.576252937316896, 37.30911647598541], [15.412702560424806, 37.67132087507], [15.558614730834961, 38.02473460822767], [15.613503456115724, 38.38180096629129], [14.523024559020998, 38.243202382713605], [13.564982414245607, 38.38566957092227], [12.891683578491213, 38.37789851200675]]
-    test_dict['land_only_polygon'] = [[-118.72972011566164, 34.96358310815083], [-118.7426805496216, 34.95392512349466], [-118.741851747036, 34.94128020346737], [-118.71324330568315, 34.94121204335055], [-118.7131454050541, 34.958508603969236], [-118.72972011566164, 34.96358310815083]]
-    test_dict['water_only_polygon'] = [[-120.3117620944977, 32.9773526159236], [-120.35270333290102, 32.75546576141111], [-120.1521009206772, 32.67390732403642], [-119.98687148094179, 32.86846786484173], [-120.13354003429414, 33.02966016839023], [-120.3117620944977, 32.9773526159236]]
-    test_dict['iceland'] = [[-24.94102478027344,66.62561451469584],[-25.57823181152344,64.39753122058228],[-21.39690399169922,62.66783857582993],[-14.134597778320314,63.92877326933141],[-12.479438781738283,65.8834234934428],[-15.170745849609377,67.10232345139119],[-20.71918487548828,66.8000257591103],[-24.94102478027344,66.62561451469584]]
-    test_dict['hawaii'] = [[-179.04796600341797,30.02213803127762],[-179.18907165527344,27.3516430588189],[-154.93640899658206,17.047594180752778],[-152.70618438720703,20.787893513679396],[-176.56642913818362,30.084542946324945],[-179.04796600341797,30.02213803127762]] 
-    test_dict['new_zealand'] = [[168.65386962890628,-33.35462041843625],[159.8057556152344,-46.10323266470107],[173.57917785644534,-49.428840000635226],[183.55407714843753,-37.05572508596021],[173.2358551025391,-30.40959743218008],[168.65386962890628,-33.35462041843625]]
-    test_dict['caspian'] = [[50.81485748291016,47.31101290750725],[46.719017028808594,45.51151979926975],[46.25965118408204,44.07093712790448],[48.88195037841797,40.34065649361507],[48.49777221679688,37.68219008286376],[51.170883178710945,36.26766697814671],[54.774913787841804,36.636330360763424],[54.51227188110352,40.06296452858627],[53.103275299072266,40.7290474687069],[52.686481475830085,42.31260817230085],[53.21794509887696,43.012806405561534],[51.24092102050782,44.009607826541234],[51.98129653930665,45.02051982382388],[54.285507202148445,46.16746780081259],[53.84605407714844,47.512679047971524],[50.81485748291016,47.31101290750725]]
-    test_dict['mkarim_aoi_test'] = [[121.60471394359236, 0.926601871146752], [121.60723686218263, 0.939203159928641], [123.02743434906007, 0.661997370761501], [123.02170505480076, 0.623377007098447], [121.60471394359236, 0.926601871146752]]
-    test_dict['indonesia_standard_test'] = [[121.60723686218263,0.9392031599286415],[121.10701560974123,-1.559265273083022],[122.64930725097658,-1.8812422453465736],[122.64930725097658,-1.8869040083433015],[123.02743434906007,0.6619973707615012],[121.60723686218263,0.9392031599286415]]
-    test_dict['antimeridian_test'] = [[170.85868835449222,-31.22718805085655],[184.91981506347656,-37.86319934044902],[174.5549011230469,-42.04954757896978],[170.85868835449222,-31.22718805085655]]
-    test_dict['clockwise_antimeridian'] = [[164.4309997558594,-29.858510452312025],[190.13900756835938,-30.9104727678728],[165.3813171386719,-52.6130549393468],[164.4309997558594,-29.858510452312025]]
-    test_dict['counterclockwise_antimeridian'] = [[190.73501586914062,-32.31499127724556],[162.78991699218753,-30.70641975748972],[160.29327392578128,-49.230153752280884],[187.09991455078128,-46.60228013300285],[190.73501586914062,-32.31499127724556]]
-    test_dict['new_test_self_intersect'] = [[-61.87762962928407, 11.906899306846999], [-63.39987332594009, 12.204027982906016], [-63.452772907302574, 12.194862236528072], [-63.7737099161362, 12.012531384424141], [-64.044868, 10.641438], [-61.79129, 10.194783], [-61.528248053566784, 11.475793113716037], [-61.54109499802273, 11.510941947273063], [-61.87762962928407, 11.906899306846999]]
-    result["land_only_polygon"] = [False,True,True,False,5.6,0.0,1.00,0.00]
-    result["new_test_self_intersect"] = [True,True,False,False,720.4,44024.8,0.02,0.98]
-    result["caspian"] = [True,True,False,False,160119.0,379902.8,0.30,0.70]
-    result["iceland"] = [True,True,False,False,102765.7,111487.3,0.48,0.52]
-    result["new_zealand"] = [True,True,False,False,267330.9,6214898.8,0.04,0.96]
-    result["land_and_water_polygon"] = [True,True,False,False,25496.5,23308.5,0.52,0.48]
-    result["hawaii"] = [True,True,False,False,16679.6,1136885.8,0.014,0.99]
-    result["indonesia_standard_test"] = [True,True,False,False,6475.6,41115.8,0.14,0.86]
-    result["counterclockwise_antimeridian"] = [True,True,False,False,267334.2,7647594.2,0.033,0.97]
-    result["mkarim_aoi_test"] = [False,True,True,False,461.7,0.0,1.00,0.00]
-    result["clockwise_antimeridian"] = [True,True,False,False,267902.0,5556725.1,0.05,0.95]
-    result["antimeridian_test"] = [True,True,False,False,114487.2,10825478.1,0.01,0.99]
-    result["water_only_polygon"] = [True,False,False,True,0.0,858.7,0.00,1.00]
-    function_list = [covers_water, covers_land, covers_only_land, covers_only_water, get_land_area, get_water_area, get_land_percentage, get_water_percentage]
+# reference polygons over sicily, hawaii, etc, name -> exterior ring
+TEST_POLYGONS = {}
+TEST_POLYGONS['land_and_water_polygon'] = [[12.891683578491213, 38.37789851200675], [11.765542030334474, 38.11254460084754], [12.869324684143068, 37.133463744616456], [14.642543792724611, 36.54194981843648], [15.757741928100588, 36.6001975253107], [15.576252937316896, 37.30911647598541], [15.412702560424806, 37.67132087507], [15.558614730834961, 38.02473460822767], [15.613503456115724, 38.38180096629129], [14.523024559020998, 38.243202382713605], [13.564982414245607, 38.38566957092227], [12.891683578491213, 38.37789851200675]]
+TEST_POLYGONS['land_only_polygon'] = [[-118.72972011566164, 34.96358310815083], [-118.7426805496216, 34.95392512349466], [-118.741851747036, 34.94128020346737], [-118.71324330568315, 34.94121204335055], [-118.7131454050541, 34.958508603969236], [-118.72972011566164, 34.96358310815083]]
+TEST_POLYGONS['water_only_polygon'] = [[-120.3117620944977, 32.9773526159236], [-120.35270333290102, 32.75546576141111], [-120.1521009206772, 32.67390732403642], [-119.98687148094179, 32.86846786484173], [-120.13354003429414, 33.02966016839023], [-120.3117620944977, 32.9773526159236]]
+TEST_POLYGONS['iceland'] = [[-24.94102478027344,66.62561451469584],[-25.57823181152344,64.39753122058228],[-21.39690399169922,62.66783857582993],[-14.134597778320314,63.92877326933141],[-12.479438781738283,65.8834234934428],[-15.170745849609377,67.10232345139119],[-20.71918487548828,66.8000257591103],[-24.94102478027344,66.62561451469584]]
+TEST_POLYGONS['hawaii'] = [[-179.04796600341797,30.02213803127762],[-179.18907165527344,27.3516430588189],[-154.93640899658206,17.047594180752778],[-152.70618438720703,20.787893513679396],[-176.56642913818362,30.084542946324945],[-179.04796600341797,30.02213803127762]]
+TEST_POLYGONS['new_zealand'] = [[168.65386962890628,-33.35462041843625],[159.8057556152344,-46.10323266470107],[173.57917785644534,-49.428840000635226],[183.55407714843753,-37.05572508596021],[173.2358551025391,-30.40959743218008],[168.65386962890628,-33.35462041843625]]
+TEST_POLYGONS['caspian'] = [[50.81485748291016,47.31101290750725],[46.719017028808594,45.51151979926975],[46.25965118408204,44.07093712790448],[48.88195037841797,40.34065649361507],[48.49777221679688,37.68219008286376],[51.170883178710945,36.26766697814671],[54.774913787841804,36.636330360763424],[54.51227188110352,40.06296452858627],[53.103275299072266,40.7290474687069],[52.686481475830085,42.31260817230085],[53.21794509887696,43.012806405561534],[51.24092102050782,44.009607826541234],[51.98129653930665,45.02051982382388],[54.285507202148445,46.16746780081259],[53.84605407714844,47.512679047971524],[50.81485748291016,47.31101290750725]]
+TEST_POLYGONS['mkarim_aoi_test'] = [[121.60471394359236, 0.926601871146752], [121.60723686218263, 0.939203159928641], [123.02743434906007, 0.661997370761501], [123.02170505480076, 0.623377007098447], [121.60471394359236, 0.926601871146752]]
+TEST_POLYGONS['indonesia_standard_test'] = [[121.60723686218263,0.9392031599286415],[121.10701560974123,-1.559265273083022],[122.64930725097658,-1.8812422453465736],[122.64930725097658,-1.8869040083433015],[123.02743434906007,0.6619973707615012],[121.60723686218263,0.9392031599286415]]
+TEST_POLYGONS['antimeridian_test'] = [[170.85868835449222,-31.22718805085655],[184.91981506347656,-37.86319934044902],[174.5549011230469,-42.04954757896978],[170.85868835449222,-31.22718805085655]]
+TEST_POLYGONS['clockwise_antimeridian'] = [[164.4309997558594,-29.858510452312025],[190.13900756835938,-30.9104727678728],[165.3813171386719,-52.6130549393468],[164.4309997558594,-29.858510452312025]]
+TEST_POLYGONS['counterclockwise_antimeridian'] = [[190.73501586914062,-32.31499127724556],[162.78991699218753,-30.70641975748972],[160.29327392578128,-49.230153752280884],[187.09991455078128,-46.60228013300285],[190.73501586914062,-32.31499127724556]]
+TEST_POLYGONS['new_test_self_intersect'] = [[-61.87762962928407, 11.906899306846999], [-63.39987332594009, 12.204027982906016], [-63.452772907302574, 12.194862236528072], [-63.7737099161362, 12.012531384424141], [-64.044868, 10.641438], [-61.79129, 10.194783], [-61.528248053566784, 11.475793113716037], [-61.54109499802273, 11.510941947273063], [-61.87762962928407, 11.906899306846999]]
+
+# expected covers_water, covers_land, covers_only_land, covers_only_water, land area, water area,
+# land and water percentages of each reference polygon, the columns of TEST_FUNCTIONS
+TEST_RESULTS = {}
+TEST_RESULTS["land_only_polygon"] = [False,True,True,False,5.6,0.0,1.00,0.00]
+TEST_RESULTS["new_test_self_intersect"] = [True,True,False,False,720.4,44024.8,0.02,0.98]
+TEST_RESULTS["caspian"] = [True,True,False,False,160119.0,379902.8,0.30,0.70]
+TEST_RESULTS["iceland"] = [True,True,False,False,102765.7,111487.3,0.48,0.52]
+TEST_RESULTS["new_zealand"] = [True,True,False,False,267330.9,2021075.7,0.12,0.88]
+TEST_RESULTS["land_and_water_polygon"] = [True,True,False,False,25496.5,23308.5,0.52,0.48]
+TEST_RESULTS["hawaii"] = [True,True,False,False,16679.6,1136885.8,0.014,0.99]
+TEST_RESULTS["indonesia_standard_test"] = [True,True,False,False,6475.6,41115.8,0.14,0.86]
+TEST_RESULTS["counterclockwise_antimeridian"] = [True,True,False,False,267334.2,3983848.2,0.063,0.94]
+TEST_RESULTS["mkarim_aoi_test"] = [False,True,True,False,461.7,0.0,1.00,0.00]
+TEST_RESULTS["clockwise_antimeridian"] = [True,True,False,False,267902.0,2574598.9,0.09,0.91]
+TEST_RESULTS["antimeridian_test"] = [True,True,False,False,114487.2,515115.1,0.18,0.82]
+TEST_RESULTS["water_only_polygon"] = [True,False,False,True,0.0,858.7,0.00,1.00]
+TEST_FUNCTIONS = [covers_water, covers_land, covers_only_land, covers_only_water, get_land_area, get_water_area, get_land_percentage, get_water_percentage]
+
+def test(engine=None):
+    '''runs a test over sicily, hawaii, etc, with the given land area engine'''
+    if engine is not None:
+        configure({'water_mask_engine': engine})
     print_list = ['Covers any water?  {:15}        {}',
                   'Covers any land?   {:15}        {}',
                   'Covers only land?  {:15}        {}',
@@ -213,13 +768,40 @@ def test():
                   'Land coverage:     {:15,.2f}        {}',
                   'Water coverage:    {:15,.2f}        {}']
 
-    for name, coords in test_dict.iteritems():
+    for name, coords in TEST_POLYGONS.items():
         geojson = {"type":"Polygon", "coordinates": [coords]}
         print('------------------------------------------------------')
         print('Evaluating area:   {}'.format(name))
-        for i in range(len(function_list)):
-            val = function_list[i](geojson)
-            print(print_list[i].format(val, comparison(val, result[name][i])))
+        for i in range(len(TEST_FUNCTIONS)):
+            val = TEST_FUNCTIONS[i](geojson)
+            print(print_list[i].format(val, comparison(val, TEST_RESULTS[name][i])))
+
+def compare_engines():
+    '''Prints the land area of the test polygons from the polygon and raster engines'''
+    global ENGINE
+    engine = ENGINE
+    try:
+        for name, coords in sorted(TEST_POLYGONS.items()):
+            geojson = {"type":"Polygon", "coordinates": [coords]}
+            ENGINE = 'polygon'
+            polygon_area = get_land_area(geojson)
+            ENGINE = 'raster'
+            raster_area = get_land_area(geojson)
+            delta = abs(raster_area - polygon_area)
+            # the same check as gtUtil.isTrackSelected, in 90 m pixels along a 250 km track
+            print('{:30} polygon {:15,.1f} km^2   raster {:15,.1f} km^2   delta {:10,.1f} km^2 {:10,.1f} px'.format(
+                name, polygon_area, raster_area, delta, delta / 250 / (90.0 / 1000)))
+    finally:
+        ENGINE = engine
 
 if __name__ == '__main__':
-    test()
+    if len(sys.argv) > 1 and sys.argv[1] == '--build-cache':
+        build_shape_cache()
+    elif len(sys.argv) > 1 and sys.argv[1] == '--build-grid':
+        build_land_fraction()
+    elif len(sys.argv) > 1 and sys.argv[1] == '--compare':
+        compare_engines()
+    elif len(sys.argv) > 2 and sys.argv[1] == '--engine':
+        test(sys.argv[2])
+    else:
+        test()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+'''
+Parsed Sentinel-1 EOF orbit files. Each file is parsed once per process into
+arrays of state vector time, position, velocity and quality, and cached on
+disk next to it as <orbit file>.npz, so groundTrack can check orbit quality
+and build ground tracks for any number of windows from one parse.
+'''
+import os, datetime, logging
+import xml.etree.ElementTree as ET
+import numpy as np
+
+# set logger
+log_format = "[%(asctime)s: %(levelname)s/%(name)s/%(funcName)s] %(message)s"
+logging.basicConfig(format=log_format, level=logging.INFO)
+
+class LogFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, 'id'): record.id = '--'
+        return True
+
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+logger.setLevel(logging.INFO)
+logger.addFilter(LogFilter())
+
+
+MARGIN = 60.0 # seconds of state vectors kept on each side of a window, as ISCE's extractPreciseOrbit
+orbits = {} #globals for speed, orbit file -> dict of arrays
+
+
+def get_cache_file(orbit_file):
+    '''Returns the path of the parsed cache of an orbit file'''
+    return os.path.splitext(orbit_file)[0] + '.npz'
+
+
+def parse_orbit_file(orbit_file):
+    '''Parses the state vectors of an EOF file into a dict of time (datetime64[us]), position and
+    velocity ((n, 3) m and m/s, ECEF) and quality arrays'''
+    root = ET.parse(orbit_file).getroot()
+    times, states, quality = [], [], []
+    for osv in root.iter('OSV'):
+        times.append(osv.find('UTC').text.strip()[4:]) # UTC=2019-01-01T00:00:00.000000
+        states.append([float(osv.find(tag).text) for tag in ('X', 'Y', 'Z', 'VX', 'VY', 'VZ')])
+        quality.append(osv.find('Quality').text.strip())
+    states = np.array(states, dtype=np.float64).reshape(-1, 6)
+    return {'time': np.array(times, dtype='datetime64[us]'),
+            'position': states[:, :3],
+            'velocity': states[:, 3:],
+            'quality': np.array(quality, dtype='U16')}
+
+
+def load_orbit(orbit_file):
+    '''Returns the parsed state vectors of an orbit file, parsed once per process and read from
+    its .npz cache when that is newer than the file'''
+    orbit_file = os.path.abspath(orbit_file)
+    if orbit_file in orbits:
+        return orbits[orbit_file]
+    cache = get_cache_file(orbit_file)
+    orbit = None
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(orbit_file):
+        try:
+            with np.load(cache) as data:
+                orbit = dict((name, data[name]) for name in ('time', 'position', 'velocity', 'quality'))
+        except (IOError, OSError, ValueError, KeyError) as err:
+            logger.info("Ignoring orbit cache %s : %s" %(cache, err))
+    if orbit is None:
+        logger.info("Parsing orbit file %s" %orbit_file)
+        orbit = parse_orbit_file(orbit_file)
+        try:
+            tmp = cache + '.tmp.npz'
+            np.savez(tmp, **orbit)
+            os.rename(tmp, cache)
+        except (IOError, OSError) as err:
+            logger.info("Could not write orbit cache %s : %s" %(cache, err))
+    orbits[orbit_file] = orbit
+    return orbit
+
+
+def get_window(orbit, tstart, tend, margin=MARGIN):
+    '''Returns the indexes of the state vectors from tstart - margin up to tend + margin'''
+    margin = np.timedelta64(int(margin * 1e6), 'us')
+    start = np.datetime64(tstart, 'us') - margin
+    end = np.datetime64(tend, 'us') + margin
+    return np.flatnonzero((orbit['time'] >= start) & (orbit['time'] < end))
+
+
+def is_nominal(orbit_file, tstart, tend, margin=MARGIN):
+    '''Returns False if any state vector around tstart to tend is not tagged NOMINAL'''
+    orbit = load_orbit(orbit_file)
+    window = get_window(orbit, tstart, tend, margin)
+    bad = window[orbit['quality'][window] != 'NOMINAL']
+    if len(bad) > 0:
+        logger.info("State Vector at time %s tagged as %s in orbit file %s, excluding the date data" %(orbit['time'][bad[0]], orbit['quality'][bad[0]], orbit_file))
+        return False
+    return True
+
+
+def get_state_vectors(orbit_file, tstart, tend, margin=MARGIN):
+    '''Returns the times (datetime), positions and velocities of the state vectors around tstart to tend'''
+    orbit = load_orbit(orbit_file)
+    window = get_window(orbit, tstart, tend, margin)
+    return orbit['time'][window].astype(datetime.datetime), orbit['position'][window], orbit['velocity'][window]
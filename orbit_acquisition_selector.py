@@ -2,7 +2,8 @@
 import os, sys, time, json, requests, logging
 import re, traceback, argparse, copy, bisect
 from xml.etree import ElementTree
-from UrlUtils import UrlUtils
+import esUtil
+import esAsync
 import util
 import gtUtil
 from util import ACQ
@@ -38,37 +39,10 @@ MISSION = 'S1A'
 
 
 def query_es(query, es_index=None):
-    logger.info("query: %s" %query)
     """Query ES."""
-    uu = UrlUtils()
-    es_url = uu.rest_url
-    rest_url = es_url[:-1] if es_url.endswith('/') else es_url
-    url = "{}/_search?search_type=scan&scroll=60&size=100".format(rest_url)
-    if es_index:
-        url = "{}/{}/_search?search_type=scan&scroll=60&size=100".format(rest_url, es_index)
-    logger.info("url: {}".format(url))
-    r = requests.post(url, data=json.dumps(query))
-    r.raise_for_status()
-    scan_result = r.json()
-    #logger.info("scan_result: {}".format(json.dumps(scan_result, indent=2)))
-    count = scan_result['hits']['total']
-    if count == 0:
-        return []
-
-
-    if '_scroll_id' not in scan_result:
-        logger.info("_scroll_id not found in scan_result. Returning empty array for the query :\n%s" %query)
-        return []
-
-    scroll_id = scan_result['_scroll_id']
-    hits = []
-    while True:
-        r = requests.post('%s/_search/scroll?scroll=60m' % rest_url, data=scroll_id)
-        res = r.json()
-        scroll_id = res['_scroll_id']
-        if len(res['hits']['hits']) == 0: break
-        hits.extend(res['hits']['hits'])
-    return hits
+    logger.info("query: %s" %query)
+    logger.info("es_index: {}".format(es_index))
+    return esUtil.query_es(query, es_index)
 
 
 
@@ -432,7 +406,7 @@ def get_covered_acquisitions_by_track_date(aoi, acqs, threshold_pixel, orbit_fil
     logger.info("\nget_covered_acquisitions_by_track_date")
     
     logger.info("PROCESSING AOI : %s : %s" %(aoi['id'], aoi['location']))
-    grouped_matched = util.group_acqs_by_track_date_from_metadata(acqs) #group_acqs_by_track(acqs)
+    grouped_matched = util.group_acqs_by_track_date(acqs) #group_acqs_by_track(acqs)
     logger.info("grouped_matched Done")
     print_groups(grouped_matched)
 
@@ -545,9 +519,12 @@ def query_aoi_acquisitions(starttime, endtime, platform, orbit_file, orbit_dir,
     if not aois or len(aois) <=0:
         logger.info("Existing as NO AOI Found")
         sys.exit(0)
+    aois_by_id = {}
+    queries = {}
     for aoi in aois:
         logger.info("aoi: {}".format(aoi['id']))
-        query = {
+        aois_by_id[aoi['id']] = aoi
+        queries[aoi['id']] = {
             "query": {
                 "filtered": {
                     "query": {
@@ -594,16 +571,22 @@ def query_aoi_acquisitions(starttime, endtime, platform, orbit_file, orbit_dir,
                     }
                 }
             },
-            "partial_fields" : {
-                "partial" : {
-                    "include" : [ "id", "dataset_type", "dataset", "metadata", "city", "continent", "starttime", "endtime"]
-                }
-            }
+            "partial_fields" : util.projection("acq_core")
         }
-        logger.info(query)
-        acqs = [i['fields']['partial'][0] for i in query_es(query, es_index)]
+        logger.info(queries[aoi['id']])
+
+    acqs_by_aoi = dict((aoi_id, []) for aoi_id in queries)
+
+    def add_acqs(aoi_id, hits):
+        '''Builds the ACQ objects of a page of an AOI's acquisitions as it lands, so its hits are not kept.'''
+        acqs_by_aoi[aoi_id].extend(util.create_acqs_from_hits(hits))
+
+    def evaluate(aoi_id):
+        '''Runs the water mask selection of an AOI as soon as all its acquisitions have landed.'''
+        aoi = aois_by_id[aoi_id]
+        acqs = acqs_by_aoi.pop(aoi_id)
         logger.info("Found {} acqs for {}: {}".format(len(acqs), aoi['id'],
-                    json.dumps([i['id'] for i in acqs], indent=2)))
+                    json.dumps([acq.acq_id[0] for acq in acqs], indent=2)))
 
         #logger.info("ALL ACQ of AOI : \n%s" %acqs)
         if len(acqs) <=0:
@@ -618,7 +601,7 @@ def query_aoi_acquisitions(starttime, endtime, platform, orbit_file, orbit_dir,
 
         if len(selected_track_acqs.keys())==0:
             logger.info("Nothing selected from AOI %s " %aoi['id'])
-            continue
+            return
 
         #for acq in acqs:
         aoi_data = {}
@@ -634,6 +617,11 @@ def query_aoi_acquisitions(starttime, endtime, platform, orbit_file, orbit_dir,
         #acq_info[aoi_data['id']] = acq
 	#aoi_acq[aoi] = acq_info 
         #logger.info("Acquistions to localize: {}".format(json.dumps(acq_info, indent=2)))
+
+    # query every AOI concurrently, streaming each one's pages, and evaluate each as its last page comes back
+    esAsync.fan_out(queries, es_index, callback=evaluate, on_page=add_acqs, **esUtil.pagination("acquisition"))
+    # keep the AOIs in query order whatever order their results came back in
+    orbit_aoi_data = dict((aoi['id'], orbit_aoi_data[aoi['id']]) for aoi in aois if aoi['id'] in orbit_aoi_data)
     if len(orbit_aoi_data.keys())<=0:
         logger.info("Existing as NOTHING selected for any aois")
         sys.exit(0)
@@ -704,6 +692,9 @@ def resolve_aoi_acqs(ctx_file):
 
     project = ctx['project']
     logger.info("PROJECT : %s" %project)
+    esUtil.configure(ctx)
+    esAsync.configure(ctx)
+    lightweight_water_mask.configure(ctx)
     priority = int(ctx["job_priority"])
     minMatch = int(ctx["minMatch"])
     dataset_version = ctx["dataset_version"] 
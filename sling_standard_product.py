@@ -5,6 +5,7 @@ from datetime import datetime
 from hysds_commons.job_utils import resolve_hysds_job
 from hysds.celery import app
 import util
+import esUtil
 import uuid  # only need this import to simulate returned mozart job id
 from hysds.celery import app
 from hysds_commons.job_utils import submit_mozart_job
@@ -99,7 +100,7 @@ def query_es(endpoint, doc_id):
         search_url = '%s%s/_search' % (es_url, es_index)
     else:
         search_url = '%s/%s/_search' % (es_url, es_index)
-    r = requests.post(search_url, data=json.dumps(query))
+    r = esUtil.post(search_url, query)
 
     if r.status_code != 200:
         print("Failed to query %s:\n%s" % (es_url, r.text))
@@ -246,7 +247,7 @@ def check_ES_status(doc_id):
         search_url = '%s%s/_search' % (es_url, es_index)
     else:
         search_url = '%s/%s/_search' % (es_url, es_index)
-    r = requests.post(search_url, data=json.dumps(query))
+    r = esUtil.post(search_url, query)
 
     if r.status_code != 200:
         print("Failed to query %s:\n%s" % (es_url, r.text))
@@ -270,7 +271,7 @@ def check_ES_status(doc_id):
         time.sleep(sleep_seconds)
         #result = ES.search(index=es_index, body=query)
 
-        r = requests.post(search_url, data=json.dumps(query))
+        r = esUtil.post(search_url, query)
 
         if r.status_code != 200:
             print("Failed to query %s:\n%s" % (es_url, r.text))
@@ -286,23 +287,11 @@ def check_ES_status(doc_id):
 
 def check_slc_status(slc_id, index_suffix):
 
-    result = util.get_dataset(slc_id, index_suffix)
-    total = result['hits']['total']
-
-    if total > 0:
-	return True
-
-    return False
+    return util.dataset_exists(slc_id, index_suffix)
 
 def check_slc_status(slc_id):
 
-    result = util.get_dataset(slc_id)
-    total = result['hits']['total']
-
-    if total > 0:
-        return True
-
-    return False
+    return esUtil.exists({"query": {"ids": {"values": [slc_id]}}}, "grq")
 
 def get_acq_data_from_list(acq_list):
     logger.info("get_acq_data_from_list")
@@ -905,7 +894,7 @@ def check_ES_status(doc_id):
         search_url = '%s%s/_search' % (es_url, es_index)
     else:
         search_url = '%s/%s/_search' % (es_url, es_index)
-    r = requests.post(search_url, data=json.dumps(query))
+    r = esUtil.post(search_url, query)
 
     if r.status_code != 200:
         print("Failed to query %s:\n%s" % (es_url, r.text))
@@ -929,7 +918,7 @@ def check_ES_status(doc_id):
         time.sleep(sleep_seconds)
         #result = ES.search(index=es_index, body=query)
 
-        r = requests.post(search_url, data=json.dumps(query))
+        r = esUtil.post(search_url, query)
 
         if r.status_code != 200:
             print("Failed to query %s:\n%s" % (es_url, r.text))
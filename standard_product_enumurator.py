@@ -3,7 +3,7 @@ import util
 #from hysds.celery import app
 import os, sys, re, requests, json, logging, traceback, argparse, copy, bisect
 import hashlib
-from UrlUtils import UrlUtils
+import esUtil
 from itertools import product, chain
 from datetime import datetime, timedelta
 import numpy as np
@@ -77,6 +77,7 @@ def create_acq_obj_from_metadata(acq):
     return ACQ(acq_id, download_url, track, location, starttime, endtime, direction, orbitnumber, identifier, pv, platform)
 
 def create_acqs_from_metadata(frames):
+    ''' Creates ACQ Objects from acquisition metadata. frames can be any iterable'''
     acqs = []
     #print("frame length : %s" %len(frames))
     for acq in frames:
@@ -111,71 +112,13 @@ def get_orbit_date(s):
 
 def query_es(query, es_index=None):
     """Query ES."""
-    uu = UrlUtils()
-    es_url = uu.rest_url
-    rest_url = es_url[:-1] if es_url.endswith('/') else es_url
-    url = "{}/_search?search_type=scan&scroll=60&size=100".format(rest_url)
-    if es_index:
-        url = "{}/{}/_search?search_type=scan&scroll=60&size=100".format(rest_url, es_index)
-    #logger.info("url: {}".format(url))
-    r = requests.post(url, data=json.dumps(query))
-    r.raise_for_status()
-    scan_result = r.json()
-    #logger.info("scan_result: {}".format(json.dumps(scan_result, indent=2)))
-    count = scan_result['hits']['total']
-    if count == 0:
-        return []
-
-    if '_scroll_id' not in scan_result:
-        logger.info("_scroll_id not found in scan_result. Returning empty array for the query :\n%s" %query)
-        return []
-
-    scroll_id = scan_result['_scroll_id']
-    hits = []
-    while True:
-        r = requests.post('%s/_search/scroll?scroll=60m' % rest_url, data=scroll_id)
-        res = r.json()
-        scroll_id = res['_scroll_id']
-        if len(res['hits']['hits']) == 0: break
-        hits.extend(res['hits']['hits'])
-    return hits
+    return esUtil.query_es(query, es_index)
 
 def process_query(query):
-    uu = UrlUtils()
-    es_url = uu.rest_url
-    rest_url = es_url[:-1] if es_url.endswith('/') else es_url
-    #dav_url =  "https://aria-dav.jpl.nasa.gov"
-    #version = "v1.1"
     grq_index_prefix = "grq"
 
     logger.info("query: {}".format(json.dumps(query, indent=2)))
-
-
-    # get index name and url
-    url = "{}/{}/_search?search_type=scan&scroll=60&size=100".format(rest_url, grq_index_prefix)
-    logger.info("url: {}".format(url))
-    r = requests.post(url, data=json.dumps(query))
-    r.raise_for_status()
-    scan_result = r.json()
-    count = scan_result['hits']['total']
-    print("count : %s" %count)
-    if count == 0:
-        return []
-
-
-    if '_scroll_id' not in scan_result:
-        logger.info("_scroll_id not found in scan_result. Returning empty array for the query :\n%s" %query)
-        return []
-    scroll_id = scan_result['_scroll_id']
-    ref_hits = []
-    while True:
-        r = requests.post('%s/_search/scroll?scroll=60m' % rest_url, data=scroll_id)
-        res = r.json()
-        scroll_id = res['_scroll_id']
-        if len(res['hits']['hits']) == 0: break
-        ref_hits.extend(res['hits']['hits'])
-
-    return ref_hits
+    return esUtil.query_es(query, grq_index_prefix)
 
 def get_aoi_blacklist_data(aoi):
     logger.info("get_aoi_blacklist_data %s" %aoi)
@@ -214,7 +157,7 @@ def get_aoi_blacklist_data(aoi):
 
 
     logger.info(query)
-    bls = [i['fields']['partial'][0] for i in query_es(query, es_index)]
+    bls = [i['fields']['partial'][0] for i in esUtil.query_es(query, es_index, **esUtil.pagination("blacklist"))]
     logger.info("Found {} bls for {}: {}".format(len(bls), aoi['aoi_id'],
                     json.dumps([i['id'] for i in bls], indent=2)))
 
@@ -405,6 +348,15 @@ def print_candidate_pair(candidate_pair):
 
 
 
+def get_slave_queries(track_dts, selected_track_acqs, master_union_data, aoi_location, track, orbit_data, acquisition_version):
+    '''Yields the slave finding query of each master date, filling master_union_data as it goes'''
+    for track_dt in track_dts:
+        master_union_data[track_dt] = util.get_union_data_from_acqs(selected_track_acqs[track_dt])
+        master_ipf_count, master_starttime, master_endtime, master_location, master_track, direction, master_orbitnumber = master_union_data[track_dt]
+        query = util.get_overlapping_slaves_query(util.get_isoformat_date(master_starttime), aoi_location, track, direction, orbit_data['platform'], master_orbitnumber, acquisition_version)
+        logger.info("Slave Finding Query for %s : %s" %(track_dt, query))
+        yield query
+
 def get_candidate_pair_list(aoi, track, selected_track_acqs, aoi_data, orbit_data, job_data, aoi_blacklist, threshold_pixel, acquisition_version):
     logger.info("get_candidate_pair_list : %s Orbits" %len(selected_track_acqs.keys()))
     candidate_pair_list = []
@@ -416,36 +368,39 @@ def get_candidate_pair_list(aoi, track, selected_track_acqs, aoi_data, orbit_dat
     aoi_id = aoi_data['aoi_id']
 
     orbitNumber = []
-   
+    track_dts = sorted(selected_track_acqs.keys(), reverse=True)
+    es_index = "grq_%s_acquisition-s1-iw_slc/acquisition-S1-IW_SLC/" %(acquisition_version)
+    logger.info("es_index : %s" %es_index) 
+
+    # the slave finding queries go out in _msearch batches of dates, each one only once the
+    # previous dates are processed, so none are sent for the dates after MIN_MATCH is reached
+    master_union_data = {}
+    slave_queries = get_slave_queries(track_dts, selected_track_acqs, master_union_data, aoi_location, track, orbit_data, acquisition_version)
+    slave_hits = esUtil.iter_msearch(slave_queries, es_index, **esUtil.pagination("acquisition"))
 
-    for track_dt in sorted(selected_track_acqs.keys(), reverse=True):
+    for track_dt, hits in zip(track_dts, slave_hits):
         logger.info(track_dt)
    
         slaves_track = {}
         slave_acqs = []
             
         master_acqs = selected_track_acqs[track_dt]
-        master_ipf_count, master_starttime, master_endtime, master_location, master_track, direction, master_orbitnumber = util.get_union_data_from_acqs(master_acqs)
+        master_ipf_count, master_starttime, master_endtime, master_location, master_track, direction, master_orbitnumber = master_union_data[track_dt]
         #master_ipf_count = util.get_ipf_count(master_acqs)
         #master_union_geojson = util.get_union_geojson_acqs(master_acqs)
         orbitNumber.append(master_orbitnumber)
 
         #util.print_acquisitions(aoi_data['aoi_id'], master_acqs)
-        query = util.get_overlapping_slaves_query(util.get_isoformat_date(master_starttime), aoi_location, track, direction, orbit_data['platform'], master_orbitnumber, acquisition_version)
-        logger.info("Slave Finding Query : %s" %query)
-        es_index = "grq_%s_acquisition-s1-iw_slc/acquisition-S1-IW_SLC/" %(acquisition_version)
-        logger.info("es_index : %s" %es_index) 
-        acqs = [i['fields']['partial'][0] for i in util.query_es2(query, es_index)]
-        logger.info("Found {} slave acqs : {}".format(len(acqs),
-        json.dumps([i['id'] for i in acqs], indent=2)))
+        slave_acqs = create_acqs_from_metadata(hit['fields']['partial'][0] for hit in hits)
+        logger.info("Found {} slave acqs : {}".format(len(slave_acqs),
+        json.dumps([acq.acq_id[0] for acq in slave_acqs], indent=2)))
 
 
-        if len(acqs) == 0:
+        if len(slave_acqs) == 0:
             logger.info("ERROR ERROR : NO SLAVE FOUND for AOI %s and track %s" %(aoi_data['aoi_id'], track))
             continue
 
         #matched_acqs = util.create_acqs_from_metadata(process_query(query))
-        slave_acqs = create_acqs_from_metadata(acqs)
         logger.info("\nSLAVE ACQS")
         #util.print_acquisitions(aoi_id, slave_acqs)
 
@@ -765,18 +720,11 @@ def publish_initiator_pair(candidate_pair, publish_job_data, orbit_data, aoi_id,
     # set job type and disk space reqs
     disk_usage = "300GB"
 
-    # query doc
-    uu = UrlUtils()
-    es_url = uu.rest_url
-
-    grq_index_prefix = "grq"
-    rest_url = es_url[:-1] if es_url.endswith('/') else es_url
-    url = "{}/{}/_search?search_type=scan&scroll=60&size=100".format(rest_url, grq_index_prefix)
-
     # get metadata
-    master_md = { i:util.get_metadata(i, rest_url, url) for i in master_acquisitions }
+    md = util.get_metadata_bulk(list(master_acquisitions) + list(slave_acquisitions), profile="acq_publish")
+    master_md = { i:md[i] for i in master_acquisitions }
     #logger.info("master_md: {}".format(json.dumps(master_md, indent=2)))
-    slave_md = { i:util.get_metadata(i, rest_url, url) for i in slave_acquisitions }
+    slave_md = { i:md[i] for i in slave_acquisitions }
     #logger.info("slave_md: {}".format(json.dumps(slave_md, indent=2)))
 
     # get tracks
@@ -6,6 +6,7 @@ from dateutil import parser
 from hysds_commons.job_utils import resolve_hysds_job
 from hysds.celery import app
 import util
+import esUtil
 import uuid  # only need this import to simulate returned mozart job id
 from hysds.celery import app
 from hysds_commons.job_utils import submit_mozart_job
@@ -107,7 +108,7 @@ def query_es(endpoint, doc_id):
         search_url = '%s%s/_search' % (es_url, es_index)
     else:
         search_url = '%s/%s/_search' % (es_url, es_index)
-    r = requests.post(search_url, data=json.dumps(query))
+    r = esUtil.post(search_url, query)
 
     if r.status_code != 200:
         print("Failed to query %s:\n%s" % (es_url, r.text))
@@ -253,7 +254,7 @@ def check_ES_status(doc_id):
         search_url = '%s%s/_search' % (es_url, es_index)
     else:
         search_url = '%s/%s/_search' % (es_url, es_index)
-    r = requests.post(search_url, data=json.dumps(query))
+    r = esUtil.post(search_url, query)
 
     if r.status_code != 200:
         print("Failed to query %s:\n%s" % (es_url, r.text))
@@ -277,7 +278,7 @@ def check_ES_status(doc_id):
         time.sleep(sleep_seconds)
         #result = ES.search(index=es_index, body=query)
 
-        r = requests.post(search_url, data=json.dumps(query))
+        r = esUtil.post(search_url, query)
 
         if r.status_code != 200:
             print("Failed to query %s:\n%s" % (es_url, r.text))
@@ -576,9 +577,10 @@ def publish_data( acq_info, project, job_priority, dem_type, track,starttime, en
     slave_slcs = get_acq_data_from_list(slave_scene)
 
     # get metadata
-    master_md = { i:query_es(GRQ_ES_ENDPOINT, i) for i in master_slcs }
+    md = util.get_metadata_bulk(list(master_slcs) + list(slave_slcs), es_url=app.conf["GRQ_ES_URL"])
+    master_md = { i:md[i] for i in master_slcs }
     #logger.info("master_md: {}".format(json.dumps(master_md, indent=2)))
-    slave_md = { i:query_es(GRQ_ES_ENDPOINT, i) for i in slave_slcs }
+    slave_md = { i:md[i] for i in slave_slcs }
     #logger.info("slave_md: {}".format(json.dumps(slave_md, indent=2)))
 
     # get urls (prefer s3)
@@ -718,7 +720,7 @@ def check_ES_status(doc_id):
         search_url = '%s%s/_search' % (es_url, es_index)
     else:
         search_url = '%s/%s/_search' % (es_url, es_index)
-    r = requests.post(search_url, data=json.dumps(query))
+    r = esUtil.post(search_url, query)
 
     if r.status_code != 200:
         print("Failed to query %s:\n%s" % (es_url, r.text))
@@ -742,7 +744,7 @@ def check_ES_status(doc_id):
         time.sleep(sleep_seconds)
         #result = ES.search(index=es_index, body=query)
 
-        r = requests.post(search_url, data=json.dumps(query))
+        r = esUtil.post(search_url, query)
 
         if r.status_code != 200:
             print("Failed to query %s:\n%s" % (es_url, r.text))
@@ -4,7 +4,7 @@ import re, traceback, argparse, copy, bisect
 from xml.etree import ElementTree
 #from hysds_commons.job_utils import resolve_hysds_job
 #from hysds.celery import app
-from UrlUtils import UrlUtils
+import esUtil
 from shapely.geometry import Polygon
 from shapely.ops import cascaded_union
 import datetime
@@ -59,6 +59,20 @@ RSP_ID_TMPL = "S1-SLCP_R{}_M{:d}S{:d}_TN{:03d}_{:%Y%m%dT%H%M%S}-{:%Y%m%dT%H%M%S}
 
 BASE_PATH = os.path.dirname(__file__)
 MISSION = 'S1A'
+meters_transform = None # globals for speed, see get_meters_transform
+
+# fields each stage reads from the GRQ documents, requested as partial_fields or _source
+PROJECTIONS = {
+    # create_acq_obj_from_metadata
+    "acq_core": [ "id", "starttime", "endtime", "metadata.download_url", "metadata.track_number",
+                  "metadata.location", "metadata.direction", "metadata.orbitNumber", "metadata.platform",
+                  "metadata.identifier", "metadata.processing_version" ],
+    # get_track, get_dem_type and get_scene_dates_from_metadata in publish_initiator_pair
+    "acq_publish": [ "id", "starttime", "endtime", "metadata.track_number", "metadata.platform", "city.country_name" ],
+    # query_orbit_file
+    "orbit": [ "id", "starttime", "endtime", "metadata.platform", "metadata.archive_filename",
+               "metadata.context.localize_urls", "urls" ],
+}
 
 
 
@@ -292,7 +306,20 @@ def create_acq_obj_from_metadata(acq):
     return ACQ(acq_id, download_url, track, location, starttime, endtime, direction, orbitnumber, identifier, pv, platform)
 
 
+def projection(profile):
+    '''Returns the partial_fields of a query that only asks for the fields of a PROJECTIONS profile.'''
+    return { "partial" : { "include" : PROJECTIONS[profile] } }
+
+def acq_from_hit(hit):
+    '''Creates the ACQ object of an acq_core partial_fields hit.'''
+    return create_acq_obj_from_metadata(hit['fields']['partial'][0])
+
+def create_acqs_from_hits(hits):
+    '''Creates ACQ objects from acq_core partial_fields hits. hits can be any iterable, e.g. esUtil.iter_hits.'''
+    return [acq for acq in (acq_from_hit(hit) for hit in hits) if acq]
+
 def create_acqs_from_metadata(frames):
+    '''Creates ACQ objects from acquisition metadata. frames can be any iterable.'''
     acqs = []
     #print("frame length : %s" %len(frames))
     for acq in frames:
@@ -326,45 +353,21 @@ def get_result_dict():
 def dataset_exists(id, index_suffix):
     """Query for existence of dataset by ID."""
 
-    # es_url and es_index
-    uu = UrlUtils()
-    es_url = uu.rest_url
     es_index = "grq_*_{}".format(index_suffix.lower())
-    
-    # query
     query = {
         "query":{
-            "bool":{
-                "must":[
-                    { "term":{ "_id": id } },
-                ]
+            "ids":{
+                "values": [ id ]
             }
-        },
-        "fields": [],
+        }
     }
-
-    if es_url.endswith('/'):
-        search_url = '%s%s/_search' % (es_url, es_index)
-    else:
-        search_url = '%s/%s/_search' % (es_url, es_index)
-    r = requests.post(search_url, data=json.dumps(query))
-    if r.status_code == 200:
-        result = r.json()
-        total = result['hits']['total']
-    else:
-        print("Failed to query %s:\n%s" % (es_url, r.text))
-        print("query: %s" % json.dumps(query, indent=2))
-        print("returned: %s" % r.text)
-        if r.status_code == 404: total = 0
-        else: r.raise_for_status()
-    return False if total == 0 else True
+    return esUtil.exists(query, es_index)
 
 def get_dataset(id, index_suffix):
     """Query for existence of dataset by ID."""
 
     # es_url and es_index
-    uu = UrlUtils()
-    es_url = uu.rest_url
+    es_url = esUtil.get_rest_url()
     es_index = "grq_*_{}".format(index_suffix.lower())
     #es_index = "grq"
 
@@ -386,7 +389,7 @@ def get_dataset(id, index_suffix):
         search_url = '%s%s/_search' % (es_url, es_index)
     else:
         search_url = '%s/%s/_search' % (es_url, es_index)
-    r = requests.post(search_url, data=json.dumps(query))
+    r = esUtil.post(search_url, query)
 
     if r.status_code != 200:
         print("Failed to query %s:\n%s" % (es_url, r.text))
@@ -402,8 +405,7 @@ def get_dataset(id):
     """Query for existence of dataset by ID."""
 
     # es_url and es_index
-    uu = UrlUtils()
-    es_url = uu.rest_url
+    es_url = esUtil.get_rest_url()
     #es_index = "grq_*_{}".format(index_suffix.lower())
     es_index = "grq"
 
@@ -425,7 +427,7 @@ def get_dataset(id):
         search_url = '%s%s/_search' % (es_url, es_index)
     else:
         search_url = '%s/%s/_search' % (es_url, es_index)
-    r = requests.post(search_url, data=json.dumps(query))
+    r = esUtil.post(search_url, query)
 
     if r.status_code != 200:
         print("Failed to query %s:\n%s" % (es_url, r.text))
@@ -440,64 +442,13 @@ def get_dataset(id):
 
 def query_es(query, es_index=None):
     """Query ES."""
-    uu = UrlUtils()
-    es_url = uu.rest_url
-    rest_url = es_url[:-1] if es_url.endswith('/') else es_url
-    url = "{}/_search?search_type=scan&scroll=60&size=100".format(rest_url)
-    if es_index:
-        url = "{}/{}/_search?search_type=scan&scroll=60&size=100".format(rest_url, es_index)
-    #print("url: {}".format(url))
-    r = requests.post(url, data=json.dumps(query))
-    r.raise_for_status()
-    scan_result = r.json()
-    #print("scan_result: {}".format(json.dumps(scan_result, indent=2)))
-    count = scan_result['hits']['total']
-    if '_scroll_id' not in scan_result:
-        print("_scroll_id not found in scan_result. Returning empty array for the query :\n%s" %query)
-        return []
-
-    scroll_id = scan_result['_scroll_id']
-    hits = []
-    while True:
-        r = requests.post('%s/_search/scroll?scroll=60m' % rest_url, data=scroll_id)
-        res = r.json()
-        scroll_id = res['_scroll_id']
-        if len(res['hits']['hits']) == 0: break
-        hits.extend(res['hits']['hits'])
-    return hits
+    return esUtil.query_es(query, es_index)
 
 
 def query_es2(query, es_index=None):
     """Query ES."""
     print(query)
-    uu = UrlUtils()
-    es_url = uu.rest_url
-    rest_url = es_url[:-1] if es_url.endswith('/') else es_url
-    url = "{}/_search?search_type=scan&scroll=60&size=100".format(rest_url)
-    if es_index:
-        url = "{}/{}/_search?search_type=scan&scroll=60&size=100".format(rest_url, es_index)
-    #print("url: {}".format(url))
-    r = requests.post(url, data=json.dumps(query))
-    r.raise_for_status()
-    scan_result = r.json()
-    #print("scan_result: {}".format(json.dumps(scan_result, indent=2)))
-    count = scan_result['hits']['total']
-    if count == 0:
-        return []
-
-    if '_scroll_id' not in scan_result:
-        print("_scroll_id not found in scan_result. Returning empty array for the query :\n%s" %query)
-        return []
-
-    scroll_id = scan_result['_scroll_id']
-    hits = []
-    while True:
-        r = requests.post('%s/_search/scroll?scroll=60m' % rest_url, data=scroll_id)
-        res = r.json()
-        scroll_id = res['_scroll_id']
-        if len(res['hits']['hits']) == 0: break
-        hits.extend(res['hits']['hits'])
-    return hits
+    return esUtil.query_es(query, es_index)
 
 def print_groups(grouped_matched):
     for track in grouped_matched["grouped"]:
@@ -508,9 +459,16 @@ def print_groups(grouped_matched):
                 print("\t\t%s" %(acq[0]))
 
 
+def get_partial_grq_data_bulk(ids):
+    '''Bulk get_partial_grq_data: one ids query per batch, returns a dict of id -> document without city.'''
+    hits = esUtil.get_by_ids(ids, "grq", source={"exclude": ["city"]})
+    missing = [i for i in ids if i not in hits]
+    if len(missing) > 0:
+        raise RuntimeError("Failed to find {}.".format(", ".join(missing)))
+    return dict((i, hits[i]['_source']) for i in ids)
+
 def get_complete_grq_data(id):
-    uu = UrlUtils()
-    es_url = uu.rest_url
+    es_url = esUtil.get_rest_url()
     es_index = "grq"
     query = {
       "query": {
@@ -533,7 +491,7 @@ def get_complete_grq_data(id):
         search_url = '%s%s/_search' % (es_url, es_index)
     else:
         search_url = '%s/%s/_search' % (es_url, es_index)
-    r = requests.post(search_url, data=json.dumps(query))
+    r = esUtil.post(search_url, query)
 
     if r.status_code != 200:
         err_str = "Failed to query %s:\n%s" % (es_url, r.text)
@@ -555,8 +513,7 @@ def get_complete_grq_data(id):
     return result['hits']['hits']
 
 def get_partial_grq_data(id):
-    uu = UrlUtils()
-    es_url = uu.rest_url
+    es_url = esUtil.get_rest_url()
     es_index = "grq"
 
     query = {
@@ -578,7 +535,7 @@ def get_partial_grq_data(id):
         search_url = '%s%s/_search' % (es_url, es_index)
     else:
         search_url = '%s/%s/_search' % (es_url, es_index)
-    r = requests.post(search_url, data=json.dumps(query))
+    r = esUtil.post(search_url, query)
 
     if r.status_code != 200:
         err_str = "Failed to query %s:\n%s" % (es_url, r.text)
@@ -601,8 +558,7 @@ def get_partial_grq_data(id):
     return result['hits']['hits'][0]
 
 def get_acquisition_data(id):
-    uu = UrlUtils()
-    es_url = uu.rest_url
+    es_url = esUtil.get_rest_url()
     es_index = "grq_*_*acquisition*"
     query = {
       "query": {
@@ -637,7 +593,7 @@ def get_acquisition_data(id):
         search_url = '%s%s/_search' % (es_url, es_index)
     else:
         search_url = '%s/%s/_search' % (es_url, es_index)
-    r = requests.post(search_url, data=json.dumps(query))
+    r = esUtil.post(search_url, query)
 
 
     if r.status_code != 200:
@@ -776,20 +732,28 @@ def find_overlap_match(master_acq, slave_acqs):
 
     return overlapped_matches
 
-def ref_truncated(ref_scene, matched_footprints, covth=.99):
-    """Return True if reference scene will be truncated."""
+def get_meters_transform():
+    """Return the WGS84 to EPSG:3857 transformation, created once per process."""
 
-    # geometries are in lat/lon projection
-    src_srs = osr.SpatialReference()
-    src_srs.SetWellKnownGeogCS("WGS84")
-    #src_srs.ImportFromEPSG(4326)
+    global meters_transform
+    if meters_transform is None:
+        # geometries are in lat/lon projection
+        src_srs = osr.SpatialReference()
+        src_srs.SetWellKnownGeogCS("WGS84")
+        #src_srs.ImportFromEPSG(4326)
 
-    # use projection with unit as meters
-    tgt_srs = osr.SpatialReference()
-    tgt_srs.ImportFromEPSG(3857)
+        # use projection with unit as meters
+        tgt_srs = osr.SpatialReference()
+        tgt_srs.ImportFromEPSG(3857)
 
-    # create transformer
-    transform = osr.CoordinateTransformation(src_srs, tgt_srs)
+        # create transformer
+        meters_transform = osr.CoordinateTransformation(src_srs, tgt_srs)
+    return meters_transform
+
+def ref_truncated(ref_scene, matched_footprints, covth=.99):
+    """Return True if reference scene will be truncated."""
+
+    transform = get_meters_transform()
     
     # get polygon to fill if specified
     ref_geom = ogr.CreateGeometryFromJson(json.dumps(ref_scene.location))
@@ -950,8 +914,7 @@ def print_acquisitions(aoi_id, acqs):
     print("\n")
 
 def update_doc(body=None, index=None, doc_type=None, doc_id=None):
-    uu = UrlUtils()
-    es_url = uu.rest_url
+    es_url = esUtil.get_rest_url()
     ES = elasticsearch.Elasticsearch(es_url)
     ES.update(index= index, doc_type= doc_type, id=doc_id,
               body=body)
@@ -980,41 +943,16 @@ def get_bool_param(ctx, param):
     if param in ctx and isinstance(ctx[param], bool): return ctx[param]
     return True if ctx.get(param, 'true').strip().lower() == 'true' else False
 
-def get_metadata(id, rest_url, url):
-    """Get SLC metadata."""
+def get_metadata_bulk(ids, es_index="grq", es_url=None, profile=None):
+    """Get SLC metadata for all ids in one request per batch. Returns a dict keyed by id.
+    profile restricts _source to the fields of a PROJECTIONS profile."""
 
-    # query hits
-    query = {
-        "query": {
-            "term": {
-                "_id": id
-            }
-        }
-    }
-    print("query: {}".format(json.dumps(query, indent=2)))
-    r = requests.post(url, data=json.dumps(query))
-    r.raise_for_status()
-    scan_result = r.json()
-    
-    count = scan_result['hits']['total']
-    if count == 0:
-        return []
-
-    if '_scroll_id' not in scan_result:
-        print("_scroll_id not found in scan_result. Returning empty array for the query :\n%s" %query)
-        return []
-
-    scroll_id = scan_result['_scroll_id']
-    hits = []
-    while True:
-        r = requests.post('%s/_search/scroll?scroll=60m' % rest_url, data=scroll_id)
-        res = r.json()
-        scroll_id = res['_scroll_id']
-        if len(res['hits']['hits']) == 0: break
-        hits.extend(res['hits']['hits'])
-    if len(hits) == 0:
-        raise RuntimeError("Failed to find {}.".format(id))
-    return hits[0]
+    source = PROJECTIONS[profile] if profile else None
+    hits = esUtil.get_by_ids(ids, es_index, es_url, source)
+    missing = [i for i in ids if i not in hits]
+    if len(missing) > 0:
+        raise RuntimeError("Failed to find {}.".format(", ".join(missing)))
+    return hits
 
 def get_dem_type(info):
     """Get dem type."""
@@ -1045,11 +983,7 @@ def get_overlapping_slaves_query(master):
     
 def get_overlapping_slaves_query(starttime, location, track, direction, platform, master_orbitnumber, acquisition_version):
     query = {
-      "partial_fields": {
-        "partial": {
-          "exclude": "city"
-        }
-      },
+      "partial_fields": projection("acq_core"),
       "query": {
         "filtered": {
           "filter": {
@@ -1351,19 +1285,7 @@ def query_orbit_file(starttime, endtime, platform):
           ]
         }
       },
-      "partial_fields": {
-        "partial": {
-          "include": [
-            "id",
-            "starttime",
-            "endtime",
-            "metadata.platform",
-            "metadata.archive_filename",
-            "metadata.context.localize_urls",
-            "urls"
-          ]
-        }
-      }
+      "partial_fields": projection("orbit")
     }
 
     print(query)
@@ -1371,7 +1293,7 @@ def query_orbit_file(starttime, endtime, platform):
 
 
     # filter inactive
-    hits = [i['fields']['partial'][0] for i in query_es(query)]
+    hits = [i['fields']['partial'][0] for i in esUtil.query_es(query, es_index, **esUtil.pagination("orbit"))]
     #print("hits: {}".format(json.dumps(hits, indent=2)))
     #print("aois: {}".format(json.dumps([i['id'] for i in hits])))
     return hits